@@ -0,0 +1,81 @@
+"""
+Cache of the merged answers data (output of get_ps_data()) in a columnar binary format.
+
+The data are stored in an uncompressed Feather file with compact types (see compact_ps_data()),
+so they can be loaded with memory mapping. The cache is rebuilt automatically,
+when the size or the modification time of any source CSV file changes.
+Feather format needs pyarrow, without it the data are loaded from the CSV files.
+"""
+
+import importlib.util
+import json
+import os
+from data.prepare_data import (get_ps_data, compact_ps_data, LOGS_PATH, QUESTIONS_PATH, PRACTICE_SETS_PATH,
+                               PS_MAPPING_PATH)
+
+SOURCE_PATHS = [LOGS_PATH, QUESTIONS_PATH, PRACTICE_SETS_PATH, PS_MAPPING_PATH]
+CACHE_PATH = 'data/ps_data.feather'
+
+
+def get_sources_signature(source_paths=SOURCE_PATHS):
+    """Returns size and modification time of each source file."""
+    signature = {}
+    for path in source_paths:
+        stat = os.stat(path)
+        signature[path] = [stat.st_size, stat.st_mtime_ns]
+    return signature
+
+
+def _signature_path(cache_path):
+    return os.path.splitext(cache_path)[0] + '.json'
+
+
+def is_cache_valid(cache_path=CACHE_PATH, source_paths=SOURCE_PATHS):
+    """Returns True if the cache exists and was created from the current source files."""
+    if not os.path.exists(cache_path) or not os.path.exists(_signature_path(cache_path)):
+        return False
+    with open(_signature_path(cache_path)) as f:
+        return json.load(f) == get_sources_signature(source_paths)
+
+
+def save_ps_data(ps_data, signature, cache_path=CACHE_PATH):
+    """Saves ps_data to the cache together with the signature of the source files they were loaded from."""
+    from pyarrow import feather
+    ps_data = compact_ps_data(ps_data).reset_index(drop=True)
+    feather.write_feather(ps_data, cache_path, compression='uncompressed')
+    with open(_signature_path(cache_path), 'w') as f:
+        json.dump(signature, f)
+
+
+def load_ps_data(cache_path=CACHE_PATH, memory_map=True):
+    """Loads ps_data from the cache."""
+    from pyarrow import feather
+    return feather.read_table(cache_path, memory_map=memory_map).to_pandas()
+
+
+def get_cached_ps_data(cache_path=CACHE_PATH, memory_map=True):
+    """Returns DataFrame with all answers and their important attributes (same as get_ps_data()).
+
+    The data are loaded from the cache, if it's valid. Otherwise they are loaded by get_ps_data()
+    and the cache is (re)built.
+
+    Parameters
+    ----------
+    cache_path : str
+        Path of the Feather file
+    memory_map : bool
+        True if you want to load the cache with memory mapping
+
+    Returns
+    -------
+    DataFrame
+    """
+    if importlib.util.find_spec('pyarrow') is None:
+        print("Package pyarrow is not installed, data are loaded without cache.")
+        return get_ps_data(compact=True)
+
+    if not is_cache_valid(cache_path):
+        # signature before loading, so the changes during loading invalidate the cache
+        signature = get_sources_signature()
+        save_ps_data(get_ps_data(), signature, cache_path)
+    return load_ps_data(cache_path, memory_map)
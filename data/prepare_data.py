@@ -6,7 +6,13 @@ import re
 import pandas as pd
 import numpy as np
 import os
-from similarities.performance_similarities import pearson_similarity, doublepearson_similarity
+from scipy import sparse
+from similarities.performance_similarities import pearson_similarity, doublepearson_similarity, SparseCorrectnessMatrix
+
+LOGS_PATH = 'data/nova_doplnovacka_log.csv'
+QUESTIONS_PATH = 'data/nova_doplnovacka_questions.csv'
+PRACTICE_SETS_PATH = 'data/system_ps_problem.csv'
+PS_MAPPING_PATH = 'data/system_ps.csv'
 
 
 def cut_answer_question(value):
@@ -66,15 +72,156 @@ def merge_data_with_practice_sets(logs_questions, practice_sets, ps_mapping):
     return ps_data
 
 
-def get_ps_data():
-    """Returns DataFrame with all answers and their important attributes."""
-    logs = pd.read_csv('data/nova_doplnovacka_log.csv', sep=';')
-    questions = pd.read_csv('data/nova_doplnovacka_questions.csv', sep=';')
-    system_ps_problem = pd.read_csv('data/system_ps_problem.csv', sep=';')
-    system_ps = pd.read_csv('data/system_ps.csv', sep=';')
+def get_ps_data(compact=False):
+    """Returns DataFrame with all answers and their important attributes.
+
+    Parameters
+    ----------
+    compact : bool
+        True if you want the data with compact types of columns (see compact_ps_data())
+
+    Returns
+    -------
+    DataFrame
+    """
+    logs = pd.read_csv(LOGS_PATH, sep=';')
+    questions = pd.read_csv(QUESTIONS_PATH, sep=';')
+    system_ps_problem = pd.read_csv(PRACTICE_SETS_PATH, sep=';')
+    system_ps = pd.read_csv(PS_MAPPING_PATH, sep=';')
     basic_data = merge_logs_with_questions(logs, questions)
     ps_data = merge_data_with_practice_sets(basic_data, system_ps_problem, system_ps)
-    return ps_data 
+    if compact:
+        return compact_ps_data(ps_data)
+    return ps_data
+
+
+ID_COLUMNS = ['id', 'user', 'question_id', 'ps', 'parent_kc', 'exercise']
+TEXT_COLUMNS = ['question', 'correct_answer', 'url']
+# texts that are the same in all answers of a question ('url' belongs to the practice set)
+QUESTION_COLUMNS = ['question', 'correct_answer']
+
+
+def _compact_ids(column):
+    """Downcasts ids to the smallest integer type, ids with missing values to float32 (if it's exact)."""
+    if column.notnull().all():
+        return pd.to_numeric(column, downcast='integer')
+    compact = column.astype(np.float32)
+    if (compact.values == column.values)[column.notnull().values].all():
+        return compact
+    return column
+
+
+def compact_ps_data(ps_data):
+    """Returns ps_data with compact types of columns.
+
+    Integer ids are downcast to the smallest integer type (columns with missing values to float32),
+    'correct' is stored as int8 and repeated texts 'question', 'correct_answer' and 'url' as categoricals.
+    Values aren't changed, only their types.
+
+    Parameters
+    ----------
+    ps_data : DataFrame
+        Merged data coming from merge_data_with_practice_sets()
+
+    Returns
+    -------
+    DataFrame
+    """
+    # shallow copy, the replaced columns don't change the original data
+    ps_data = ps_data.copy(deep=False)
+    for column in ID_COLUMNS:
+        if column in ps_data.columns:
+            ps_data[column] = _compact_ids(ps_data[column])
+    if 'correct' in ps_data.columns and ps_data['correct'].isin([0, 1]).all():
+        ps_data['correct'] = ps_data['correct'].astype(np.int8)
+    for column in TEXT_COLUMNS:
+        if column in ps_data.columns:
+            ps_data[column] = ps_data[column].astype('category')
+    return ps_data
+
+
+def split_question_attributes(ps_data, columns=QUESTION_COLUMNS):
+    """Moves attributes of questions (texts repeated in every answer) from ps_data to a side table of questions.
+
+    EXAMPLE:
+        answers, questions = split_question_attributes(ps_data)
+        ps_data = join_question_attributes(answers, questions)
+
+    Parameters
+    ----------
+    ps_data : DataFrame
+        Merged data coming from merge_data_with_practice_sets()
+    columns : list of str
+        Attributes of questions, each question must have just one value of each attribute
+
+    Returns
+    -------
+    tuple of (DataFrame, DataFrame)
+        Answers without the attributes and the attributes indexed by question_id
+    """
+    columns = [column for column in columns if column in ps_data.columns]
+    questions = ps_data[['question_id'] + columns].drop_duplicates()
+    if questions['question_id'].duplicated().any():
+        raise ValueError("Attributes {} aren't the same in all answers of a question.".format(columns))
+    return ps_data.drop(columns, axis=1), questions.set_index('question_id')
+
+
+def join_question_attributes(answers, questions):
+    """Returns answers joined with the attributes of questions (output of split_question_attributes())."""
+    return answers.join(questions, on='question_id')
+
+
+class PsDataIndex():
+    """Index of ps_data for repeated slicing by knowledge components and practice sets.
+
+    First answers of users to questions are found once for each knowledge component and practice set,
+    their positions are grouped by the knowledge component (practice set). A slice then costs time
+    proportional to its size.
+
+    EXAMPLE:
+        index = PsDataIndex(ps_data)
+        data = get_data_by_knowledge_component(index, 26)
+        data = get_data_for_practice_sets(index, [383, 384, 385])
+    """
+
+    def __init__(self, ps_data):
+        """Initialization of the index.
+
+        Parameters
+        ----------
+        ps_data : DataFrame
+            Merged data coming from merge_data_with_practice_sets()
+        """
+        self.ps_data = ps_data
+        kc_first = ~ps_data.duplicated(['user', 'question_id', 'parent_kc'], keep='first').values
+        kc_first[kc_first] = ~ps_data[kc_first].duplicated(['id', 'parent_kc'], keep='first').values
+        self.kc_positions = self._group_positions(ps_data['parent_kc'].values, kc_first)
+        ps_first = ~ps_data.duplicated(['user', 'question_id', 'ps'], keep='first').values
+        self.ps_positions = self._group_positions(ps_data['ps'].values, ps_first)
+
+    @staticmethod
+    def _group_positions(keys, mask):
+        """Returns positions of the rows in mask grouped by their keys (missing keys are left out)."""
+        positions = np.flatnonzero(mask)
+        groups = pd.Series(positions).groupby(keys[positions]).indices
+        return {key: positions[group] for key, group in groups.items()}
+
+    def _empty_positions(self):
+        return np.array([], dtype=np.intp)
+
+    def knowledge_component(self, kc_number):
+        """Returns the data for knowledge component (same as get_data_by_knowledge_component())."""
+        return self.ps_data.iloc[self.kc_positions.get(kc_number, self._empty_positions())]
+
+    def practice_sets(self, practice_sets_numbers):
+        """Returns the data for practice sets (same as get_data_for_practice_sets())."""
+        positions = [self.ps_positions[ps] for ps in set(practice_sets_numbers) if ps in self.ps_positions]
+        positions = np.sort(np.concatenate(positions)) if positions else self._empty_positions()
+        data = self.ps_data.iloc[positions]
+        if len(positions) > 0 and len(practice_sets_numbers) > 1:
+            # user could answer the question in more practice sets
+            data = data.drop_duplicates(['user', 'question_id'], keep='first')
+        return data
 
 
 def get_data_by_knowledge_component(ps_data, kc_number):
@@ -89,8 +236,8 @@ def get_data_by_knowledge_component(ps_data, kc_number):
 
     Parameters
     ----------
-    ps_data : DataFrame
-        Merged data coming from merge_data_with_practice_sets()
+    ps_data : DataFrame or PsDataIndex
+        Merged data coming from merge_data_with_practice_sets() or their index (faster for repeated calls)
     kc_number : int
         Number of knowledge component that you want to get data from
 
@@ -98,6 +245,8 @@ def get_data_by_knowledge_component(ps_data, kc_number):
     -------
     DataFrame
     """
+    if isinstance(ps_data, PsDataIndex):
+        return ps_data.knowledge_component(kc_number)
     return ps_data[ps_data['parent_kc'] == kc_number].drop_duplicates(['user', 'question_id'], keep='first').drop_duplicates(['id'], keep='first')
 
 
@@ -113,8 +262,8 @@ def get_data_for_practice_sets(ps_data, practice_sets_numbers):
 
     Parameters
     ----------
-    ps_data : DataFrame
-        Merged data coming from merge_data_with_practice_sets()
+    ps_data : DataFrame or PsDataIndex
+        Merged data coming from merge_data_with_practice_sets() or their index (faster for repeated calls)
     practice_sets_numbers : list of int
         List of practice sets numbers that you want to get data from
 
@@ -122,17 +271,118 @@ def get_data_for_practice_sets(ps_data, practice_sets_numbers):
     -------
     DataFrame
     """
+    if isinstance(ps_data, PsDataIndex):
+        return ps_data.practice_sets(practice_sets_numbers)
     ps_data = ps_data[ps_data.ps.isin(practice_sets_numbers)]
     data = ps_data.drop_duplicates(['user', 'question_id'], keep='first')
     return data
 
 
+def _first_occurrences(data, seen, columns):
+    """Returns rows whose key (values of columns) wasn't seen yet (in data or in the previous chunks)."""
+    data = data.drop_duplicates(columns, keep='first')
+    keys = list(zip(*[data[column] for column in columns]))
+    new = np.array([key not in seen for key in keys], dtype=bool)
+    seen.update(keys)
+    return data[new]
+
+
+def stream_ps_data(ps_filter, question_ids, drop_duplicate_ids=False, chunksize=1000000):
+    """Returns first answers of users to questions, the log of answers is processed by chunks.
+
+    Each chunk of the log is joined with the questions and practice sets, filtered and deduplicated
+    (first occurrence of (user, question_id) across all chunks), so only the selected data are kept in memory.
+
+    Parameters
+    ----------
+    ps_filter : function
+        Function that returns boolean mask of rows of merged data that should be kept
+    question_ids : list of int
+        Questions that can pass the filter (answers of other questions are dropped before the joins)
+    drop_duplicate_ids : bool
+        True if you want only first occurrence of each answer id
+    chunksize : int
+        Number of rows of the log in one chunk
+
+    Returns
+    -------
+    DataFrame
+    """
+    questions = pd.read_csv(QUESTIONS_PATH, sep=';')
+    system_ps_problem = pd.read_csv(PRACTICE_SETS_PATH, sep=';')
+    system_ps = pd.read_csv(PS_MAPPING_PATH, sep=';')
+    seen_answers, seen_ids = set(), set()
+    chunks = []
+
+    for logs in pd.read_csv(LOGS_PATH, sep=';', usecols=['id', 'user', 'question', 'correct'], chunksize=chunksize):
+        logs = logs[logs['question'].isin(question_ids)]
+        data = merge_data_with_practice_sets(merge_logs_with_questions(logs, questions), system_ps_problem, system_ps)
+        data = _first_occurrences(data[ps_filter(data)], seen_answers, ['user', 'question_id'])
+        if drop_duplicate_ids:
+            data = _first_occurrences(data, seen_ids, ['id'])
+        chunks.append(data)
+    return pd.concat(chunks)
+
+
+def stream_data_by_knowledge_component(kc_number, chunksize=1000000):
+    """Returns DataFrame with the data for specified knowledge component (same as get_data_by_knowledge_component()).
+
+    The log of answers is processed by chunks, see stream_ps_data().
+    """
+    system_ps_problem = pd.read_csv(PRACTICE_SETS_PATH, sep=';')
+    system_ps = pd.read_csv(PS_MAPPING_PATH, sep=';')
+    practice_sets = system_ps.loc[system_ps['parent'] == kc_number, 'id']
+    question_ids = system_ps_problem.loc[system_ps_problem['ps'].isin(practice_sets), 'problem'].unique()
+    return stream_ps_data(lambda data: data['parent_kc'] == kc_number, question_ids, True, chunksize)
+
+
+def stream_data_for_practice_sets(practice_sets_numbers, chunksize=1000000):
+    """Returns DataFrame with the data for specified practice sets (same as get_data_for_practice_sets()).
+
+    The log of answers is processed by chunks, see stream_ps_data().
+    """
+    system_ps_problem = pd.read_csv(PRACTICE_SETS_PATH, sep=';')
+    question_ids = system_ps_problem.loc[system_ps_problem['ps'].isin(practice_sets_numbers), 'problem'].unique()
+    return stream_ps_data(lambda data: data['ps'].isin(practice_sets_numbers), question_ids, False, chunksize)
+
+
 def get_vyjmenovana_slova_po_b(ps_data):
     """Returns DataFrame of concept 'Vyjmenovaná slova B'."""
     return get_data_for_practice_sets(ps_data, [383, 384, 385])
 
 
-def reshape_to_correctness_matrix(data):
+def reshape_to_sparse_correctness_matrix(data):
+    """Reshapes data of answers to sparse correctness matrix (users are rows and questions are columns).
+
+    Matrices are built directly from integer codes of users and questions (only first answer
+    of the user to the question is used), the dense matrix is never created.
+
+    Parameters
+    ----------
+    data : DataFrame
+        Answers data that contain 'user', 'question_id', 'correct' attributes
+
+    Returns
+    -------
+    SparseCorrectnessMatrix
+        Answered and correct matrices with the users and questions
+    """
+    user_codes, users = pd.factorize(data['user'], sort=True)
+    question_codes, questions = pd.factorize(data['question_id'], sort=True)
+    # first occurrence of each (user, question) pair
+    keys = user_codes.astype(np.int64) * len(questions) + question_codes
+    _, first = np.unique(keys, return_index=True)
+    user_codes, question_codes = user_codes[first], question_codes[first]
+    correct = data['correct'].values[first].astype(float)
+
+    shape = (len(users), len(questions))
+    answered = sparse.csc_matrix((np.ones(len(first)), (user_codes, question_codes)), shape=shape)
+    correct = sparse.csc_matrix((correct, (user_codes, question_codes)), shape=shape)
+    return SparseCorrectnessMatrix(answered, correct, pd.Index(users, name='user'),
+                                   pd.Index(questions, name='question_id'))
+
+
+def reshape_to_correctness_matrix(data, sparse_matrix=False):
     """Reshapes data of answers to matrix where the users are the indices(rows) and columns are the questions.
 
     After reshaping, the values in the matrix are specified by the correctness of the user's answer,
@@ -142,13 +392,19 @@ def reshape_to_correctness_matrix(data):
     ----------
     data : DataFrame
         Answers data that contain 'user', 'question_id', 'correct' attributes
+    sparse_matrix : bool
+        True if you want SparseCorrectnessMatrix (see reshape_to_sparse_correctness_matrix()),
+        it can be used by the similarity functions in the same way as the DataFrame.
 
     Returns
     -------
-    DataFrame
+    DataFrame or SparseCorrectnessMatrix
         Correctness matrix
     """
     if pd.Series(['user','question_id','correct']).isin(data.columns).all():
+        if sparse_matrix:
+            return reshape_to_sparse_correctness_matrix(data)
+
         # we want only first occurrence
         data = data.drop_duplicates(['user','question_id'], keep='first')
 
@@ -169,7 +425,7 @@ def correctness_matrix_to_similarity_matrix(method, matrix, no_nans=False):
     method : str
         Method/Measure used for computing similarities
         'pearson', 'doublepearson' can be used.
-    data : DataFrame
+    data : DataFrame or SparseCorrectnessMatrix
         Correctness matrix (output of reshape_to_correctness_matrix())
     no_nans : bool
         Parameter that specifies, if the similarity matrix can contain NaN values or not
@@ -189,6 +445,36 @@ def correctness_matrix_to_similarity_matrix(method, matrix, no_nans=False):
     return similarity_matrix
 
 
+def get_question_metadata(data, columns=None):
+    """Returns attributes of each question (taken from its first answer in data) indexed by question_id.
+
+    The metadata can be built once and then aligned with the index of any similarity matrix (align_to_questions()).
+
+    Parameters
+    ----------
+    data : DataFrame
+        Answers data that contain 'question_id'
+    columns : list of str
+        Attributes of questions, all columns by default
+
+    Returns
+    -------
+    DataFrame
+    """
+    metadata = data.drop_duplicates('question_id', keep='first').set_index('question_id')
+    return metadata if columns is None else metadata[columns]
+
+
+def align_to_questions(question_ids, metadata, column):
+    """Returns values of the column of metadata (output of get_question_metadata()) for each question_id.
+
+    EXAMPLE:
+        metadata = get_question_metadata(data)
+        ground_truth = align_to_questions(similarity_matrix.index, metadata, 'manual_label')
+    """
+    return metadata[column].reindex(question_ids).values
+
+
 def get_labels_and_practice_sets_for_similarity_matrix(matrix, pre_matrix_data):
     """Returns labels and practice sets for similarity matrix.
 
@@ -197,18 +483,17 @@ def get_labels_and_practice_sets_for_similarity_matrix(matrix, pre_matrix_data):
     matrix : DataFrame
         Similarity matrix
     pre_matrix_data : DataFrame
-        Data in the state before similarity matrix
+        Data in the state before similarity matrix or their metadata (output of get_question_metadata())
 
     Returns
     -------
     tuple of (list of labels, list of practice_sets)
         Label and practice set for each question from the similarity matrix index
     """
-
-    question_ids = matrix.index
-    pre_matrix_data = pre_matrix_data.set_index('question_id')
-    labels = np.array([pre_matrix_data.at[question_id, 'question'][0] for question_id in question_ids])
-    practice_sets = np.array([pre_matrix_data.at[question_id, 'ps'][0] for question_id in question_ids])
+    if 'question_id' in pre_matrix_data.columns:
+        pre_matrix_data = get_question_metadata(pre_matrix_data, ['question', 'ps'])
+    labels = align_to_questions(matrix.index, pre_matrix_data, 'question')
+    practice_sets = align_to_questions(matrix.index, pre_matrix_data, 'ps')
     return labels, practice_sets
 
 
@@ -217,6 +502,52 @@ class UnderscoresError(Exception):
     NOTE: Now there are just questions with 0 or 1 underscore in the dataset."""
 
 
+SOLUTION_METHODS = ('full', 'fillin', 'fillinextra')
+# the word with the underscore (its part before and after the underscore)
+WORD_WITH_UNDERSCORE = re.compile(r"(\w*)_(\w*)")
+
+
+def get_all_solutions(data):
+    """Returns solutions for the dataset for all methods ('full', 'fillin', 'fillinextra') at once.
+
+    Parameters
+    ----------
+    data : DataFrame
+        Answers data that contain 'question' and 'correct_answer'
+
+    Returns
+    -------
+    DataFrame
+        Columns 'full', 'fillin' and 'fillinextra' with the same index as data
+    """
+    # answers contain the same questions many times, so the solutions are computed only for distinct pairs
+    # missing values (code -1) are replaced by empty strings (code 0)
+    question_codes, question_values = pd.factorize(data['question'])
+    question_values = np.append('', np.asarray(question_values, dtype=object).astype(str)).astype(object)
+    answer_codes, answer_values = pd.factorize(data['correct_answer'])
+    answer_values = np.append('', np.asarray(answer_values, dtype=object).astype(str)).astype(object)
+    distinct, codes = np.unique((question_codes + 1).astype(np.int64) * len(answer_values) + answer_codes + 1,
+                                return_inverse=True)
+    questions = pd.Series(question_values[distinct // len(answer_values)], dtype=object)
+    answers = pd.Series(answer_values[distinct % len(answer_values)], dtype=object)
+
+    invalid = questions.str.count('_') != 1
+    if invalid.any():
+        invalid_rows = invalid.values[codes]
+        raise UnderscoresError("Questions without exactly one underscore:\n{}".format(
+            data.loc[invalid_rows, ['question_id', 'question']] if 'question_id' in data
+            else data.loc[invalid_rows, 'question']))
+    if len(distinct) == 0:
+        return pd.DataFrame(columns=list(SOLUTION_METHODS), index=data.index, dtype=object)
+
+    question = questions.str.split('_', n=1, expand=True)
+    word = questions.str.extract(WORD_WITH_UNDERSCORE)
+    solutions = pd.DataFrame({'full': question[0] + answers + question[1],
+                              'fillin': word[0] + answers + word[1],
+                              'fillinextra': word[0] + '(' + answers + ')' + word[1]})
+    return pd.DataFrame(solutions.values[codes], index=data.index, columns=solutions.columns)
+
+
 def get_solutions(data, method='fillin'):
     """Returns solutions for the dataset.
 
@@ -237,22 +568,10 @@ def get_solutions(data, method='fillin'):
     -------
     list of str
     """
-    solutions = []
-    for index, row in data.iterrows():
-        if row['question'].count('_') != 1:
-            raise UnderscoresError()
-        if method == 'full':
-            full_solution = row['question'].replace('_', row['correct_answer'])
-            solutions.append(full_solution)
-        elif method == 'fillin':
-            # cutting the word, where is the underscore
-            word = re.search("(\w*_\w*)", row['question']).group(1)
-            # adding the word, where was the underscore
-            solutions.append(word.replace('_', row['correct_answer']))
-        elif method == 'fillinextra':
-            word = re.search("(\w*_\w*)", row['question']).group(1)
-            solutions.append(word.replace('_', '('+row['correct_answer']+')'))
-    return solutions
+    solutions = get_all_solutions(data)
+    if method not in SOLUTION_METHODS:
+        return []
+    return solutions[method].tolist()
 
 
 def label_data(data, label_groups):
@@ -273,9 +592,9 @@ def label_data(data, label_groups):
     """
     if 'full_solution' not in data.columns:
         raise ValueError("No column 'full_solution' in data.")
-    data['manual_label'] = 0
-    for label, group in enumerate(label_groups, 1):
-        data.loc[data['full_solution'].isin(group), 'manual_label'] = label
+    # solution in more groups gets the label of the last one
+    labels = {solution: label for label, group in enumerate(label_groups, 1) for solution in group}
+    data['manual_label'] = data['full_solution'].map(labels).fillna(0).astype(int)
 
 
 if __name__ == '__main__':
@@ -1,7 +1,9 @@
+import numpy as np
 import pandas as pd
 import os
-from data.prepare_data import get_solutions, get_ps_data, get_vyjmenovana_slova_po_b
+from data.prepare_data import get_all_solutions, get_ps_data, get_vyjmenovana_slova_po_b
 from similarities.text_similarities import levenshtein_similarity
+from similarities.edit_similarity_matrix import compute_edit_similarity_matrix
 
 
 def get_word2vec_items(model, data, verbose=False):
@@ -11,8 +13,8 @@ def get_word2vec_items(model, data, verbose=False):
 
     Parameters
     ----------
-    model : Word2Vec model
-        Instantiated Word2Vec model you loaded before
+    model : Word2Vec model or WordVectors
+        Instantiated Word2Vec model you loaded before or exported word vectors (utils/word_vectors.py)
     data : DataFrame
         Data that contain 'correct_answer' and 'question' attributes
     verbose : bool
@@ -24,16 +26,18 @@ def get_word2vec_items(model, data, verbose=False):
         Word vectors and data based on the word2vec model
     """
     data = data.drop_duplicates(subset=['question_id'], keep='first').copy()
-    data['solution'] = get_solutions(data, method='fillin')
-    data['full_solution'] = get_solutions(data, method='full')
+    solutions = get_all_solutions(data)
+    data['solution'] = solutions['fillin']
+    data['full_solution'] = solutions['full']
     X, ids = [], []
+    word_vectors = getattr(model, 'wv', model)
 
     for id, solution, question in zip(data['id'], data['solution'], data['question']):
         try:
             # in slova_po_b is the word 'bicí' a big outlier in visualization, i'd rather get rid of it
             if solution == 'bicí':
                 continue
-            X.append(model.wv[solution])
+            X.append(word_vectors[solution])
             ids.append(id)
         except KeyError:
             if verbose:
@@ -43,36 +47,118 @@ def get_word2vec_items(model, data, verbose=False):
     return X, data[data['id'].isin(ids)].copy()
 
 
-def create_word2vec_similarity_matrix(model, index, solutions):
+def normalize_vectors(vectors, dtype=np.float64):
+    """Returns word vectors stacked into a matrix and L2-normalized (each row has unit length)."""
+    vectors = np.array(vectors, dtype=dtype, ndmin=2)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def create_word2vec_similarity_matrix_from_vectors(X, index, dtype=np.float64, block_size=None, out=None):
+    """Returns pairwise cosine similarity matrix of word vectors (e.g. coming from get_word2vec_items()).
+
+    Vectors are normalized once and the whole matrix is computed by matrix multiplication
+    (by blocks of rows, if block_size is specified).
+
+    Parameters
+    ----------
+    X : list of word vectors
+        Word vectors in the same order as index
+    index : list of int
+        Index and columns of pairwise similarity matrix
+    dtype : numpy dtype
+        Type of the values in the matrix, np.float32 halves the memory
+    block_size : int
+        Number of rows computed at once, whole matrix at once by default.
+    out : numpy.ndarray
+        Array (e.g. numpy.memmap) of shape (n, n) where the matrix will be written,
+        new array is allocated by default.
+
+    Returns
+    -------
+    DataFrame
+    """
+    unit_vectors = normalize_vectors(X, dtype)
+    n = len(unit_vectors)
+    if out is None:
+        out = np.empty((n, n), dtype=dtype)
+    if block_size is None:
+        block_size = max(n, 1)
+    for start in range(0, n, block_size):
+        np.dot(unit_vectors[start:start + block_size], unit_vectors.T, out=out[start:start + block_size])
+    return pd.DataFrame(out, index=index, columns=index, copy=False)
+
+
+def create_word2vec_similarity_matrix(model, index, solutions, dtype=np.float64, block_size=None, out=None):
     """Returns pairwise similarity matrix computed by using word2vec (between each pair of word vectors).
 
     In gensim library and in original papers of word2vec, cosine similarity is used for
     similarity computation between 2 word vectors.
+    Each word vector is looked up only once, then create_word2vec_similarity_matrix_from_vectors() is used.
 
     Parameters
     ----------
-    model : Word2Vec model
-        Instantiated Word2Vec model you loaded before
+    model : Word2Vec model or WordVectors
+        Instantiated Word2Vec model you loaded before or exported word vectors (utils/word_vectors.py)
     index : list of int
         Index and columns of pairwise similarity matrix
     solutions : list of str
         Words that are used for similarity matrix computation
+    dtype : numpy dtype
+        Type of the values in the matrix, np.float32 halves the memory
+    block_size : int
+        Number of rows computed at once, whole matrix at once by default.
+    out : numpy.ndarray
+        Array (e.g. numpy.memmap) of shape (n, n) where the matrix will be written,
+        new array is allocated by default.
 
     Returns
     -------
     DataFrame
     """
+    codes, words = pd.factorize(pd.Series(list(solutions), dtype=object))
+    word_vectors = getattr(model, 'wv', model)
+    vectors = np.array([word_vectors[word] for word in words])
+    return create_word2vec_similarity_matrix_from_vectors(vectors[codes], index, dtype, block_size, out)
 
-    dataframe = pd.DataFrame(index=index, columns=index)
-    for i, j in zip(solutions, index):
-        for k, l in zip(solutions, index):
-            dataframe.loc[j, l] = model.wv.similarity(i, k)
-    return dataframe
 
+def create_word2vec_similarity_rows(model, new_index, new_solutions, index, solutions):
+    """Returns rows of the pairwise word2vec similarity matrix only for new items (similarities with the existing items).
 
-def create_edit_similarity_matrix(index, solutions, similarity_function=levenshtein_similarity):
+    Parameters
+    ----------
+    model : Word2Vec model or WordVectors
+        Instantiated Word2Vec model you loaded before or exported word vectors (utils/word_vectors.py)
+    new_index : list of int
+        Index of new items (rows of the result)
+    new_solutions : list of str
+        Words of new items
+    index : list of int
+        Index of existing items (columns of the result)
+    solutions : list of str
+        Words of existing items
+
+    Returns
+    -------
+    DataFrame
+    """
+    word_vectors = getattr(model, 'wv', model)
+    new_vectors = normalize_vectors([word_vectors[solution] for solution in new_solutions])
+    vectors = normalize_vectors([word_vectors[solution] for solution in solutions])
+    return pd.DataFrame(new_vectors @ vectors.T, index=new_index, columns=index)
+
+
+def create_edit_similarity_matrix(index, solutions, similarity_function=levenshtein_similarity, n_jobs=None,
+                                  **kwargs):
     """Returns pairwise similarity matrix computed by using Edit distance (between each pair of words).
 
+    Computation is done by compute_edit_similarity_matrix() - only the upper triangle is computed,
+    identical solutions just once and in more processes.
+
+    EXAMPLE:
+        create_edit_similarity_matrix(index, solutions, levenshtein_similarity_with_threshold, M=4)
+
     Parameters
     ----------
     index : list of int
@@ -82,25 +168,28 @@ def create_edit_similarity_matrix(index, solutions, similarity_function=levensht
     similarity_function : function
         Function that is used for similarity computation between words
         Levenshtein similarity by default.
+    n_jobs : int
+        Number of processes, all CPUs are used by default.
+    **kwargs
+        Additional parameters of similarity_function, e.g. M for levenshtein_similarity_with_threshold()
 
     Returns
     -------
     DataFrame
     """
-    dataframe = pd.DataFrame(index=index, columns=index)
-    for i, j in zip(solutions, index):
-        for k, l in zip(solutions, index):
-            dataframe.loc[j, l] = similarity_function(i, k)
-    return dataframe
+    return compute_edit_similarity_matrix(index, solutions, similarity_function, n_jobs, **kwargs)
 
 
 if __name__ == '__main__':
     # example of word2vec similarity matrix creation for concept 'Vyjmenovana slova B'
     os.chdir('/home/daniel/school/BP/pythesis')
-    from gensim.models import Word2Vec
-    model = Word2Vec.load('utils/word2vec.model')
+    from similarities.matrix_store import SimilarityMatrixStore
+    from utils.word_vectors import load_word_vectors
+    # exported by: python -m utils.word_vectors utils/word2vec.model utils/word_vectors --question-bank
+    model = load_word_vectors('utils/word_vectors')
     ps_data = get_ps_data()
     slova_po_b = get_vyjmenovana_slova_po_b(ps_data)
     X, data = get_word2vec_items(model, slova_po_b)
-    word2vec_similarity_matrix = create_word2vec_similarity_matrix(model, data['question_id'], data['solution'])
-    word2vec_similarity_matrix.to_csv('data/word2vec_similarity_matrix_slova-po-b.csv')
+    word2vec_similarity_matrix = create_word2vec_similarity_matrix(model, data['question_id'], data['solution'],
+                                                                   dtype=np.float32)
+    SimilarityMatrixStore().save('word2vec', {'model': 'utils/word2vec.model'}, word2vec_similarity_matrix)
@@ -0,0 +1,172 @@
+"""
+Evaluation of similarity measures by hierarchical clustering of manually labeled items.
+
+For each dataset and measure the condensed distance matrix is computed once, one linkage tree is built
+for each linkage method and it is cut for all numbers of clusters. Measures are evaluated in a process pool
+and the adjusted Rand index of every combination is returned as one table.
+"""
+
+import multiprocessing
+import numpy as np
+import pandas as pd
+from scipy.cluster.hierarchy import linkage as linkage_tree, cut_tree
+from scipy.spatial.distance import pdist, squareform
+from sklearn.metrics import adjusted_rand_score
+from data.prepare_data import get_question_metadata, get_all_solutions, label_data, align_to_questions
+from similarities.performance_similarities import prune_nans
+
+RESULT_COLUMNS = ['dataset', 'measure', 'distance', 'linkage', 'n_clusters', 'n_items', 'dropped',
+                  'adjusted_rand_index']
+
+
+def condensed_distances(similarity_matrix, distance='precomputed'):
+    """Returns condensed distance matrix (as scipy.spatial.distance.pdist) of the items of similarity matrix.
+
+    Parameters
+    ----------
+    similarity_matrix : DataFrame
+        Similarity matrix without NaN values
+    distance : str
+        'precomputed' for distances 1 - similarity, otherwise metric of pdist() between rows
+        of the similarity matrix, e.g. 'euclidean' (second level similarity)
+
+    Returns
+    -------
+    numpy.ndarray
+    """
+    values = np.asarray(similarity_matrix, dtype=float)
+    if distance != 'precomputed':
+        return pdist(values, metric=distance)
+    distances = 1 - (values + values.T) / 2
+    np.fill_diagonal(distances, 0)
+    return squareform(np.clip(distances, 0, None), checks=False)
+
+
+def cut_clusters(tree, n_clusters):
+    """Returns labels of exactly n_clusters clusters of the linkage tree (as AgglomerativeClustering).
+
+    fcluster(tree, n, criterion='maxclust') cuts the tree at a height, so merges with the same height
+    (e.g. ties of edit distance with threshold) are all undone or all kept and it can return fewer clusters.
+
+    >>> from scipy.cluster.hierarchy import fcluster
+    >>> from sklearn.cluster import AgglomerativeClustering
+    >>> points = np.array([[0], [1], [5], [6], [20]])
+    >>> tree = linkage_tree(pdist(points), method='complete')
+    >>> labels = AgglomerativeClustering(4, linkage='complete').fit_predict(points)
+    >>> len(np.unique(cut_clusters(tree, 4))), len(np.unique(labels)), len(np.unique(fcluster(tree, 4, 'maxclust')))
+    (4, 4, 3)
+    """
+    return cut_tree(tree, n_clusters=n_clusters).ravel()
+
+
+def get_ground_truth(dataset):
+    """Returns manual label of each question of the dataset (dict with 'data' and 'labels') indexed by question_id."""
+    metadata = get_question_metadata(dataset['data'])
+    if 'full_solution' not in metadata.columns:
+        metadata['full_solution'] = get_all_solutions(metadata)['full']
+    label_data(metadata, dataset['labels'])
+    return metadata[['manual_label']]
+
+
+def evaluate_clustering(similarity_matrix, ground_truth, linkages=('complete',), n_clusters=None,
+                        distance='precomputed'):
+    """Returns adjusted Rand index of hierarchical clusterings of the labeled items of similarity matrix.
+
+    Parameters
+    ----------
+    similarity_matrix : DataFrame
+        Similarity matrix, items with NaN values are dropped
+    ground_truth : DataFrame
+        Manual labels indexed by question_id (output of get_ground_truth()), unlabeled items (0) are left out
+    linkages : list of str
+        Linkage methods of scipy.cluster.hierarchy.linkage(), e.g. 'complete', 'average', 'ward'
+        ('ward' only with 'euclidean' distance)
+    n_clusters : list of int
+        Numbers of clusters, number of manual groups by default
+    distance : str
+        'precomputed' or metric of distances between rows of the matrix (see condensed_distances())
+
+    Returns
+    -------
+    list of dict
+        Rows of the results table, 'dropped' are the items with NaN values that were dropped
+    """
+    if 'ward' in linkages and distance != 'euclidean':
+        raise ValueError("Linkage 'ward' is valid only with 'euclidean' distance, not '{}'.".format(distance))
+    labels = align_to_questions(similarity_matrix.index, ground_truth, 'manual_label')
+    labeled = np.nan_to_num(labels.astype(float)) != 0
+    similarity_matrix = similarity_matrix.loc[labeled, labeled]
+    dropped = []
+    if similarity_matrix.isnull().values.any():
+        similarity_matrix, dropped_items = prune_nans(similarity_matrix)
+        dropped = dropped_items['item'].tolist()
+    labels = align_to_questions(similarity_matrix.index, ground_truth, 'manual_label')
+    if n_clusters is None:
+        n_clusters = [len(np.unique(labels))]
+
+    condensed = condensed_distances(similarity_matrix, distance)
+    results = []
+    for method in linkages:
+        tree = linkage_tree(condensed, method=method)
+        for n in n_clusters:
+            clusters = cut_clusters(tree, n)
+            results.append({'linkage': method, 'n_clusters': n, 'n_items': len(labels), 'dropped': dropped,
+                            'adjusted_rand_index': adjusted_rand_score(labels, clusters)})
+    return results
+
+
+def _evaluate_task(task):
+    dataset_name, measure, matrix, ground_truth, distance, linkages, n_clusters = task
+    results = evaluate_clustering(matrix, ground_truth, linkages, n_clusters, distance)
+    return [dict(result, dataset=dataset_name, measure=measure, distance=distance) for result in results]
+
+
+def evaluate_measures(measures, datasets, linkages=('complete', 'average', 'ward'), n_clusters=None,
+                      distances=('precomputed', 'euclidean'), n_jobs=None):
+    """Returns adjusted Rand index of hierarchical clustering for each dataset, measure, distance, linkage and
+    number of clusters.
+
+    EXAMPLE:
+        slovab = {'name': 'vyjmenovane_slova_b', 'data': get_vyjmenovana_slova_po_b(ps_data), 'labels': SLOVA_PO_B}
+        measures = {'vyjmenovane_slova_b': [('pearson', pearson), ('word2vec', word2vec), ('ED', editdistance)]}
+        results = evaluate_measures(measures, [slovab], n_clusters=range(2, 15))
+
+    Parameters
+    ----------
+    measures : dict of (str, list of (str, DataFrame))
+        Similarity matrices of each dataset (by its name) as pairs (name of measure, similarity matrix)
+    datasets : list of dict
+        Datasets with 'name', 'data' (answers data) and 'labels' (manual groups from manual_labeling/labeled_data.py)
+    linkages : list of str
+        Linkage methods of scipy.cluster.hierarchy.linkage(), 'ward' is skipped for distances other than 'euclidean'
+    n_clusters : list of int
+        Numbers of clusters, number of manual groups of the dataset by default
+    distances : list of str
+        'precomputed' (1 - similarity) and/or metrics of distances between rows of similarity matrices
+    n_jobs : int
+        Number of processes, all CPUs are used by default.
+
+    Returns
+    -------
+    DataFrame
+        One row for each combination, 'dropped' are the items with NaN values left out of the clustering
+    """
+    tasks = []
+    for dataset in datasets:
+        ground_truth = get_ground_truth(dataset)
+        for measure, matrix in measures.get(dataset['name'], []):
+            for distance in distances:
+                distance_linkages = tuple(method for method in linkages
+                                          if method != 'ward' or distance == 'euclidean')
+                if distance_linkages:
+                    tasks.append((dataset['name'], measure, matrix, ground_truth, distance, distance_linkages,
+                                  None if n_clusters is None else list(n_clusters)))
+
+    if n_jobs is None:
+        n_jobs = multiprocessing.cpu_count()
+    if n_jobs > 1 and len(tasks) > 1:
+        with multiprocessing.Pool(min(n_jobs, len(tasks))) as pool:
+            results = pool.map(_evaluate_task, tasks)
+    else:
+        results = [_evaluate_task(task) for task in tasks]
+    return pd.DataFrame([row for rows in results for row in rows], columns=RESULT_COLUMNS)
@@ -0,0 +1,158 @@
+"""
+Agreement (correlation) of similarity measures over all pairs of items.
+
+Only the strict upper triangle of similarity matrices is used (each pair of items once, without the diagonal).
+Matrices are read by blocks of rows and only running sums are kept, so the memory doesn't depend on the number
+of pairs and memory mapped matrices (SimilarityMatrixStore) don't have to be loaded.
+"""
+
+import numpy as np
+import pandas as pd
+from similarities.performance_similarities import pearson_from_moments
+
+
+def _aligned_positions(matrices):
+    """Returns positions of the items of the first matrix in each matrix (rows and columns)."""
+    index = matrices[0][1].index
+    positions = []
+    for name, matrix in matrices:
+        if not matrix.index.equals(matrix.columns):
+            raise ValueError("Index and columns of similarity matrix '{}' are not the same.".format(name))
+        matrix_positions = matrix.index.get_indexer(index)
+        if len(matrix) != len(index) or (matrix_positions < 0).any():
+            raise ValueError("Similarity matrix '{}' doesn't have the same items as '{}'.".format(
+                name, matrices[0][0]))
+        positions.append(None if (matrix_positions == np.arange(len(index))).all() else matrix_positions)
+    return positions
+
+
+def upper_triangle_blocks(matrices, block_size=1024):
+    """Yields values of the strict upper triangle of the matrices, one array (measures x pairs) per block of rows.
+
+    Parameters
+    ----------
+    matrices : list of (str, DataFrame)
+        Similarity matrices with the same items, they are aligned to the order of the first one
+    block_size : int
+        Number of rows read at once
+
+    Yields
+    ------
+    numpy.ndarray
+    """
+    positions = _aligned_positions(matrices)
+    n = len(matrices[0][1])
+    for start in range(0, n - 1, block_size):
+        stop = min(start + block_size, n)
+        upper = np.arange(n)[np.newaxis, :] > np.arange(start, stop)[:, np.newaxis]
+        block = np.empty((len(matrices), upper.sum()))
+        for k, ((name, matrix), matrix_positions) in enumerate(zip(matrices, positions)):
+            if matrix_positions is None:
+                rows = matrix.values[start:stop]
+            else:
+                rows = matrix.values[matrix_positions[start:stop]][:, matrix_positions]
+            block[k] = rows[upper]
+        yield block
+
+
+class _RunningMoments():
+    """Pairwise-complete sufficient statistics of Pearson correlation (see pearson_from_moments())."""
+
+    def __init__(self, m):
+        self.n, self.sum_x, self.sum_xy, self.sum_xx = (np.zeros((m, m)) for _ in range(4))
+        self.shift = None
+
+    def update(self, block):
+        valid = ~np.isnan(block)
+        if self.shift is None:
+            # values are shifted by the mean of the first block, so the sums don't lose precision
+            self.shift = np.where(valid, block, 0).sum(axis=1) / np.maximum(valid.sum(axis=1), 1)
+        values = np.where(valid, block - self.shift[:, np.newaxis], 0)
+        valid = valid.astype(float)
+        self.n += valid @ valid.T
+        self.sum_x += values @ valid.T
+        self.sum_xy += values @ values.T
+        self.sum_xx += (values ** 2) @ valid.T
+
+    def correlation(self, min_periods=1):
+        return pearson_from_moments(self.n, self.sum_x, self.sum_xy, self.sum_xx, min_periods)
+
+
+def _ranks(matrices, block_size, n_bins):
+    """Returns function that maps values of each measure to their approximate (average) ranks.
+
+    Values are counted in n_bins bins of the same width between the minimum and maximum of the measure,
+    values in the same bin get the average rank of the bin.
+    """
+    m = len(matrices)
+    minimum, maximum = np.full(m, np.inf), np.full(m, -np.inf)
+    for block in upper_triangle_blocks(matrices, block_size):
+        # fmin and fmax ignore NaN values
+        minimum = np.fmin(minimum, np.fmin.reduce(block, axis=1))
+        maximum = np.fmax(maximum, np.fmax.reduce(block, axis=1))
+    minimum[~np.isfinite(minimum)] = 0
+    width = np.where(maximum > minimum, (maximum - minimum) / n_bins, 1)
+
+    def bins(block):
+        """Returns bins of the values of block and mask of the values that are not NaN."""
+        valid = ~np.isnan(block)
+        values = np.where(valid, block, minimum[:, np.newaxis])
+        block_bins = ((values - minimum[:, np.newaxis]) / width[:, np.newaxis]).astype(np.int64)
+        return np.clip(block_bins, 0, n_bins - 1), valid
+
+    counts = np.zeros((m, n_bins))
+    for block in upper_triangle_blocks(matrices, block_size):
+        block_bins, valid = bins(block)
+        for k in range(m):
+            counts[k] += np.bincount(block_bins[k][valid[k]], minlength=n_bins)
+    # average rank of the values in each bin (ranks start with 1)
+    average_ranks = np.cumsum(counts, axis=1) - (counts - 1) / 2
+
+    def rank(block):
+        block_bins, valid = bins(block)
+        return np.where(valid, np.take_along_axis(average_ranks, block_bins, axis=1), np.nan)
+    return rank
+
+
+def measure_agreement(matrices, method='pearson', min_periods=1, block_size=1024, n_bins=100000):
+    """Returns correlation of similarity measures over all pairs of items (like DataFrame.corr() of flattened
+    matrices, but each pair of items is used only once and the diagonal is left out).
+
+    EXAMPLE:
+        store = SimilarityMatrixStore()
+        matrices = [(measure, store.load(measure, parameters, index)) for measure, parameters in measures]
+        correlations = measure_agreement(matrices, method='spearman')
+
+    Parameters
+    ----------
+    matrices : list of (str, DataFrame) or dict of (str, DataFrame)
+        Similarity matrices (name of measure, matrix) with the same items
+    method : str
+        'pearson' or 'spearman'
+        Spearman correlation is approximated, ranks are computed from histograms of values with n_bins bins
+        and they are computed for each measure separately (not only over pairs with values of both measures).
+    min_periods : int
+        Minimum number of pairs of items with values of both measures required to have a valid result
+    block_size : int
+        Number of rows of matrices read at once
+    n_bins : int
+        Number of bins of histograms for approximation of ranks (Spearman correlation)
+
+    Returns
+    -------
+    DataFrame
+        Correlation matrix of measures
+    """
+    matrices = list(matrices.items()) if isinstance(matrices, dict) else list(matrices)
+    names = [name for name, matrix in matrices]
+    if method == 'pearson':
+        transform = None
+    elif method == 'spearman':
+        transform = _ranks(matrices, block_size, n_bins)
+    else:
+        raise ValueError("Method '{}' is not supported, use 'pearson' or 'spearman'.".format(method))
+
+    moments = _RunningMoments(len(matrices))
+    for block in upper_triangle_blocks(matrices, block_size):
+        moments.update(block if transform is None else transform(block))
+    return pd.DataFrame(moments.correlation(min_periods), index=names, columns=names)
@@ -1,7 +1,164 @@
+import numpy as np
+import pandas as pd
 import plotly.offline as offline
 import plotly.graph_objs as go
 import matplotlib.pyplot as plt
 
+COLORS = ['blue', 'green', 'red', 'darkcyan', 'magenta', 'orange', 'darkgray', 'purple']
+PLOTLY_COLORS = {0: 'rgb(0,0,0)', 1: 'rgb(0,0,255)', 2: 'rgb(50,205,50)', 3: 'rgb(255,0,0)', 4: 'rgb(0,139,139)',
+                 5: 'rgb(255,0,255)', 6: 'rgb(255,165,0)', 7: 'rgb(128,128,128)', 8: 'rgb(128,0,128)'}
+
+# switches between density tiles and points in the WebGL visualization, when the user zooms in or out
+DENSITY_SWITCH_SCRIPT = """
+var gd = document.getElementById('{plot_id}');
+var threshold = %(threshold)d, pointTraces = %(point_traces)s, densityTraces = %(density_traces)s;
+// point traces hidden by this script (not by the user in the legend), all of them at the start
+var hiddenTraces = pointTraces.slice(), showingPoints = false;
+
+function values(array) {
+    // numpy arrays are stored as base64 encoded typed arrays
+    if (array && array.bdata !== undefined) {
+        var bytes = Uint8Array.from(atob(array.bdata), function(c) { return c.charCodeAt(0); });
+        return new Float32Array(bytes.buffer);
+    }
+    return array;
+}
+var coordinates = pointTraces.map(function(i) { return [values(gd.data[i].x), values(gd.data[i].y)]; });
+
+function visibleItems(x, y) {
+    // items of the groups that are not hidden by the user inside the ranges of the axes (counted up to threshold + 1)
+    var xMin = Math.min(x[0], x[1]), xMax = Math.max(x[0], x[1]);
+    var yMin = Math.min(y[0], y[1]), yMax = Math.max(y[0], y[1]);
+    var count = 0;
+    for (var k = 0; k < pointTraces.length; k++) {
+        var trace = gd.data[pointTraces[k]];
+        if ((trace.visible === 'legendonly' && hiddenTraces.indexOf(pointTraces[k]) < 0) || trace.visible === false) {
+            continue;
+        }
+        var xs = coordinates[k][0], ys = coordinates[k][1];
+        for (var j = 0; j < xs.length; j++) {
+            if (xs[j] >= xMin && xs[j] <= xMax && ys[j] >= yMin && ys[j] <= yMax && ++count > threshold) {
+                return count;
+            }
+        }
+    }
+    return count;
+}
+
+gd.on('plotly_relayout', function() {
+    var showPoints = visibleItems(gd._fullLayout.xaxis.range, gd._fullLayout.yaxis.range) <= threshold;
+    if (showPoints === showingPoints) {
+        return;
+    }
+    showingPoints = showPoints;
+    if (showPoints) {
+        // only the groups hidden by the script are shown, the groups filtered out in the legend stay hidden
+        if (hiddenTraces.length > 0) {
+            Plotly.restyle(gd, {visible: true}, hiddenTraces);
+        }
+        hiddenTraces = [];
+    } else {
+        hiddenTraces = pointTraces.filter(function(i) {
+            return gd.data[i].visible !== 'legendonly' && gd.data[i].visible !== false;
+        });
+        if (hiddenTraces.length > 0) {
+            Plotly.restyle(gd, {visible: 'legendonly'}, hiddenTraces);
+        }
+    }
+    Plotly.restyle(gd, {visible: !showPoints}, densityTraces);
+});
+"""
+
+
+def scatter_by_manual_labels(ax, x_positions, y_positions, manual_labels, markersize=20, unlabeled_markersize=None,
+                             colors=COLORS):
+    """Draws items into axes, one scatter (PathCollection) for each group of manual labeling.
+
+    Unlabeled items (label 0) are black and they are drawn first, so they don't cover the labeled items.
+
+    Parameters
+    ----------
+    ax : matplotlib Axes
+    x_positions : list of x-positions of words
+    y_positions : list of y-positions of words
+    manual_labels : list of int
+        Manual label of each word (0 for unlabeled)
+    markersize : int
+        Size of the marker for labeled items
+    unlabeled_markersize : int
+        Size of the marker for unlabeled items (Matplotlib default by default)
+    colors : list of str
+        Color of each group (label 1 has the first color)
+    """
+    x_positions, y_positions = np.asarray(x_positions), np.asarray(y_positions)
+    manual_labels = np.asarray(manual_labels)
+    for label in np.unique(manual_labels):
+        group = manual_labels == label
+        if label != 0:
+            ax.scatter(x_positions[group], y_positions[group], c=colors[label - 1], s=markersize)
+        else:
+            ax.scatter(x_positions[group], y_positions[group], c='black', s=unlabeled_markersize)
+
+
+def select_annotations(x_positions, y_positions, min_distance=None, max_annotations=None):
+    """Returns positions (indices) of items that should be annotated.
+
+    Parameters
+    ----------
+    x_positions : list of x-positions of words
+    y_positions : list of y-positions of words
+    min_distance : float
+        Size of the grid cell, only the first item in each cell is annotated (overlapping annotations are culled)
+    max_annotations : int
+        Maximum number of annotations, evenly spaced items are kept
+
+    Returns
+    -------
+    numpy.ndarray
+    """
+    selected = np.arange(len(x_positions))
+    if min_distance is not None and len(selected) > 0:
+        cells = np.floor(np.column_stack([x_positions, y_positions]) / min_distance).astype(np.int64)
+        _, first = np.unique(cells, axis=0, return_index=True)
+        selected = np.sort(first)
+    if max_annotations is not None and len(selected) > max_annotations:
+        selected = selected[np.linspace(0, len(selected) - 1, max_annotations).astype(int)]
+    return selected
+
+
+def annotate_by_manual_labels(ax, x_positions, y_positions, texts, manual_labels, offset=0.5, min_distance=None,
+                              max_annotations=None, colors=COLORS, **kwargs):
+    """Annotates items in axes by their texts, colored by the groups of manual labeling.
+
+    Parameters
+    ----------
+    ax : matplotlib Axes
+    x_positions : list of x-positions of words
+    y_positions : list of y-positions of words
+    texts : list of str
+        Annotation of each word
+    manual_labels : list of int
+        Manual label of each word (0 for unlabeled)
+    offset : float
+        Shift of the annotations of labeled items on x-axis
+    min_distance : float
+        Only one annotation in each grid cell of this size is drawn (see select_annotations())
+    max_annotations : int
+        Maximum number of annotations
+    colors : list of str
+        Color of each group (label 1 has the first color)
+    **kwargs
+        Additional parameters of the annotations (e.g. fontsize)
+    """
+    x_positions, y_positions = np.asarray(x_positions), np.asarray(y_positions)
+    texts, manual_labels = np.asarray(texts), np.asarray(manual_labels)
+    for i in select_annotations(x_positions, y_positions, min_distance, max_annotations):
+        label = manual_labels[i]
+        if label != 0:
+            ax.text(x_positions[i] + offset, y_positions[i], texts[i], color=colors[label - 1], **kwargs)
+        else:
+            ax.text(x_positions[i], y_positions[i], texts[i], color='black', **kwargs)
+
 
 class Projection():
     """Contains all important attributes and actions related to projection."""
@@ -22,6 +179,45 @@ class Projection():
         self.data = data
         self.model = model
 
+    def add_items(self, similarities, data, perplexity=30, n_iter=300, learning_rate=1):
+        """Returns projection with new items placed into this (t-SNE) projection.
+
+        Positions of the existing items don't change, only the positions of the new items are optimized
+        against them (see embed_new_items()). Only similarities of the new items with the existing items are needed,
+        e.g. from compute_edit_similarity_rows(), create_word2vec_similarity_rows() or pearson_similarity_rows().
+
+        Parameters
+        ----------
+        similarities : DataFrame
+            Similarities of the new items (rows) with the existing items (columns), the columns are matched
+            with 'question_id' of the data of this projection (if it's there), otherwise they have to be in the same order.
+            Missing (NaN) similarities are ignored.
+        data : DataFrame
+            Data (words) of the new items in the same order as the rows of similarities
+        perplexity : float
+            Perplexity of t-SNE
+        n_iter : int
+            Number of iterations of the optimization
+        learning_rate : float
+            Learning rate of the optimization
+
+        Returns
+        -------
+        Projection
+        """
+        from projections.tsne_projection import embed_new_items
+        if 'question_id' in self.data.columns and hasattr(similarities, 'reindex'):
+            similarities = similarities.reindex(columns=self.data['question_id'].values)
+        distances = 1 - np.array(similarities, dtype=float)
+        distances[np.isnan(distances)] = np.inf
+        np.clip(distances, 0, None, out=distances)
+
+        positions = np.column_stack([self.x_positions, self.y_positions])
+        new_positions = embed_new_items(positions, distances, perplexity, n_iter, learning_rate)
+        return Projection(np.concatenate([np.asarray(self.x_positions), new_positions[:, 0]]),
+                          np.concatenate([np.asarray(self.y_positions), new_positions[:, 1]]),
+                          pd.concat([self.data, data]), model=self.model)
+
     def simple_scatterplot(self, figsize=(30,20), export=False, title='default', save_path='visualizations/vis.png'):
         """Matplotlib simple scatterplot without labeling."""
 
@@ -35,10 +231,13 @@ class Projection():
         plt.show()
 
     def matplotlib_plot_with_manual_labels(self, figsize=(30,20), annotate=True, export=True, markersize=20,
-                                           save_path='visualizations/vis.png', title='default', titlesize=25, unlabeled_markersize):
+                                           save_path='visualizations/vis.png', title='default', titlesize=25,
+                                           unlabeled_markersize=None, min_annotation_distance=None,
+                                           max_annotations=None):
         """Creates visualization by Matplotlib.
 
         Words are colored and divided into groups (according to manual labeling), which you can filter.
+        Each group is drawn by one scatter, so the rendering time depends on the number of groups.
 
         Parameters
         ----------
@@ -56,28 +255,30 @@ class Projection():
             Title of the visualization
         titlesize : int
             Size of the title in Figure.
+        unlabeled_markersize : int
+            Size of the marker for unlabeled items (Matplotlib default by default)
+        min_annotation_distance : float
+            Only one annotation in each grid cell of this size is drawn (all annotations by default)
+        max_annotations : int
+            Maximum number of annotations (all annotations by default)
         """
         if 'manual_label' not in self.data.columns:
             raise ValueError("Data are not labeled into groups.")
-        colors = ['blue', 'green', 'red', 'darkcyan', 'magenta', 'orange', 'darkgray', 'purple']
-        self.data.reset_index(drop=True, inplace=True)
-        for i, row in self.data.iterrows():
-            if row['manual_label'] != 0:
-                plt.scatter(self.x_positions[i], self.y_positions[i], c=colors[row['manual_label'] - 1], s=markersize)
-                if annotate:
-                    plt.annotate(row['question'], xy=(self.x_positions[i]+0.5, self.y_positions[i]),
-                                 color=colors[row['manual_label'] - 1])
-            else:
-                plt.scatter(self.x_positions[i], self.y_positions[i], c='black', s=unlabeled_markersize)
-                if annotate:
-                    plt.annotate(row['question'], xy=(self.x_positions[i], self.y_positions[i]), color='black')
+        ax = plt.gca()
+        manual_labels = self.data['manual_label'].values
+        scatter_by_manual_labels(ax, self.x_positions, self.y_positions, manual_labels, markersize,
+                                 unlabeled_markersize)
+        if annotate:
+            annotate_by_manual_labels(ax, self.x_positions, self.y_positions, self.data['question'].values,
+                                      manual_labels, min_distance=min_annotation_distance,
+                                      max_annotations=max_annotations)
         plt.gcf().set_size_inches(figsize[0], figsize[1])
         plt.title(title, fontsize=titlesize)
         if export and save_path.startswith('visualizations/'):
             plt.savefig(save_path)
         plt.show()
 
-    def plotly_with_manual_labels(self, annotate=True, save_path='visualizations/vis.html', title='default', unlabeled_markersize):
+    def plotly_with_manual_labels(self, annotate=True, save_path='visualizations/vis.html', title='default', unlabeled_markersize=5):
         """Creates visualization by Plotly.
 
         Words are colored and divided into groups (according to manual labeling), which you can filter.
@@ -90,6 +291,8 @@ class Projection():
             Path where the visualization will be saved
         title : str
             Title of the visualization
+        unlabeled_markersize : int
+            Size of the marker for unlabeled items
         """
         plotly_data = self.data.copy()
         plotly_data['x_position'] = self.x_positions
@@ -98,8 +301,7 @@ class Projection():
         manual_labels = plotly_data['manual_label'].unique()
         traces = []
         
-        colors = { 0: 'rgb(0,0,0)', 1: 'rgb(0,0,255)', 2: 'rgb(50,205,50)', 3: 'rgb(255,0,0)', 
-                  4: 'rgb(0,139,139)', 5: 'rgb(255,0,255)', 6: 'rgb(255,165,0)', 7: 'rgb(128,128,128)', 8: 'rgb(128,0,128)' }
+        colors = PLOTLY_COLORS
 
         for label in manual_labels:
             current_trace = plotly_data[plotly_data['manual_label'] == label]
@@ -112,22 +314,21 @@ class Projection():
                 hoverinfo='text',
                 textposition='middle right',
                 marker = dict(
-                    size = 5 if label == 0 else 15,
+                    size = unlabeled_markersize if label == 0 else 15,
                     color = colors[label],
                 )
             )
             traces.append(trace)
 
         layout = go.Layout(
-            title=title,
-            titlefont={'family': 'Arial', 'size': 20},
+            title=dict(text=title, font={'family': 'Arial', 'size': 20}),
             showlegend=True,
             xaxis=dict(
                 autorange=True,
                 showgrid=False,
                 zeroline=False,
                 showline=True,
-                autotick=True,
+                tickmode='auto',
                 ticks="outside",
                 showticklabels=True
             ),
@@ -136,7 +337,7 @@ class Projection():
                 showgrid=False,
                 zeroline=False,
                 showline=True,
-                autotick=True,
+                tickmode='auto',
                 ticks="outside",
                 showticklabels=True
             ),
@@ -144,3 +345,82 @@ class Projection():
         )
         fig = go.Figure(data=traces, layout=layout)
         plot_url = offline.plot(fig, filename=save_path)
+
+    def plotly_webgl_with_manual_labels(self, save_path='visualizations/vis.html', title='default',
+                                        unlabeled_markersize=5, density_threshold=20000, density_tiles=200,
+                                        include_plotlyjs='directory'):
+        """Creates visualization by Plotly suitable for large projections.
+
+        Words are colored and divided into groups (according to manual labeling), which you can filter.
+        Points are drawn by WebGL, coordinates are stored as float32 arrays and texts are shown only on hover.
+        If there are more items than density_threshold, the visualization starts with density tiles
+        (counts of items in a grid), which are replaced by the points, when the user zooms in so that
+        at most density_threshold items of the groups that aren't filtered out are in the view.
+
+        Parameters
+        ----------
+        save_path : str
+            Path where the visualization will be saved
+        title : str
+            Title of the visualization
+        unlabeled_markersize : int
+            Size of the marker for unlabeled items
+        density_threshold : int
+            Maximum number of items in the view that are drawn as points
+        density_tiles : int
+            Number of density tiles on each axis
+        include_plotlyjs : str or bool
+            'directory' links plotly.min.js saved next to the visualization (shared by all visualizations
+            in the directory), 'cdn' links plotly.js from CDN and True embeds it into the file.
+        """
+        x_positions = np.asarray(self.x_positions, dtype=np.float32)
+        y_positions = np.asarray(self.y_positions, dtype=np.float32)
+        manual_labels = self.data['manual_label'].values
+        questions = self.data['question'].values
+        aggregated = len(x_positions) > density_threshold
+
+        traces = []
+        for label in np.unique(manual_labels):
+            group = manual_labels == label
+            traces.append(go.Scattergl(
+                x=x_positions[group],
+                y=y_positions[group],
+                mode='markers',
+                name='GROUP {0}'.format(label) if label != 0 else 'UNLABELED DATA',
+                text=questions[group],
+                hoverinfo='text',
+                visible='legendonly' if aggregated else True,
+                marker=dict(
+                    size=unlabeled_markersize if label == 0 else 15,
+                    color=PLOTLY_COLORS[label],
+                )
+            ))
+
+        post_script = None
+        if aggregated:
+            counts, x_edges, y_edges = np.histogram2d(x_positions, y_positions, bins=density_tiles)
+            counts[counts == 0] = np.nan
+            traces.append(go.Heatmap(
+                x=((x_edges[:-1] + x_edges[1:]) / 2).astype(np.float32),
+                y=((y_edges[:-1] + y_edges[1:]) / 2).astype(np.float32),
+                z=counts.T.astype(np.float32),
+                name='DENSITY',
+                colorscale='Greys',
+                showscale=False,
+                hoverinfo='z'
+            ))
+            post_script = DENSITY_SWITCH_SCRIPT % dict(threshold=density_threshold,
+                                                       point_traces=list(range(len(traces) - 1)),
+                                                       density_traces=[len(traces) - 1])
+
+        axis = dict(autorange=True, showgrid=False, zeroline=False, showline=True, ticks="outside",
+                    showticklabels=True)
+        layout = go.Layout(
+            title=dict(text=title, font={'family': 'Arial', 'size': 20}),
+            showlegend=True,
+            xaxis=axis,
+            yaxis=axis,
+            hovermode='closest'
+        )
+        fig = go.Figure(data=traces, layout=layout)
+        fig.write_html(save_path, include_plotlyjs=include_plotlyjs, post_script=post_script)
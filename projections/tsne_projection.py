@@ -0,0 +1,310 @@
+"""
+t-SNE projection of items computed from precomputed distances (1 - similarity).
+
+Distances are reduced to a sparse graph of the nearest neighbours (the only affinities t-SNE needs
+for the given perplexity), the embedding is optimized by the Barnes-Hut approximation
+of the gradient and the optimization stops when KL divergence doesn't improve anymore.
+Sweep over more perplexities shares one neighbour graph and one PCA initialization and runs in a process pool.
+New items can be placed into an existing embedding without moving the existing items.
+"""
+
+import hashlib
+import inspect
+import multiprocessing
+import os
+import numpy as np
+from scipy import sparse
+from sklearn.decomposition import PCA
+from sklearn.manifold import TSNE
+from projections.base_projection import Projection
+
+
+def similarity_to_distance(similarity_matrix):
+    """Returns distance matrix (1 - similarity) as a NumPy array with zero diagonal and no negative values."""
+    distances = 1 - np.array(similarity_matrix, dtype=float)
+    np.clip(distances, 0, None, out=distances)
+    np.fill_diagonal(distances, 0)
+    return distances
+
+
+def neighbors_for_perplexity(perplexity, n_items):
+    """Returns number of nearest neighbours that t-SNE uses for the perplexity (same as scikit-learn)."""
+    return min(n_items - 1, int(3. * perplexity + 1))
+
+
+def knn_distance_graph(distances, n_neighbors, block_size=1024):
+    """Returns sparse graph (CSR matrix) with distances from each item to its n_neighbors nearest items.
+
+    Each row also contains the item itself (with zero distance) and is sorted by distances,
+    which is the form of precomputed neighbours that scikit-learn expects.
+
+    Parameters
+    ----------
+    distances : numpy.ndarray
+        Square matrix of distances
+    n_neighbors : int
+        Number of nearest neighbours of each item (without the item itself)
+    block_size : int
+        Number of rows processed at once
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+    """
+    n = len(distances)
+    n_neighbors = min(n_neighbors, n - 1)
+    neighbors = np.empty((n, n_neighbors + 1), dtype=np.intp)
+    values = np.zeros((n, n_neighbors + 1))
+    for start in range(0, n, block_size):
+        block = np.array(distances[start:start + block_size], dtype=float)
+        rows = np.arange(len(block))
+        block[rows, rows + start] = np.inf
+        nearest = np.argpartition(block, n_neighbors - 1, axis=1)[:, :n_neighbors]
+        nearest_values = np.take_along_axis(block, nearest, axis=1)
+        order = np.argsort(nearest_values, axis=1, kind='stable')
+        neighbors[start:start + len(block), 0] = rows + start
+        neighbors[start:start + len(block), 1:] = np.take_along_axis(nearest, order, axis=1)
+        values[start:start + len(block), 1:] = np.take_along_axis(nearest_values, order, axis=1)
+    indptr = np.arange(0, n * (n_neighbors + 1) + 1, n_neighbors + 1)
+    return sparse.csr_matrix((values.ravel(), neighbors.ravel(), indptr), shape=(n, n))
+
+
+def create_tsne(perplexity=30, learning_rate='auto', max_iter=1000, n_iter_without_progress=100, min_grad_norm=1e-7,
+                init='random', random_state=None, angle=0.5):
+    """Returns TSNE model for precomputed distances with Barnes-Hut gradient and early stopping.
+
+    The optimization stops after max_iter iterations, or sooner if KL divergence doesn't improve
+    for n_iter_without_progress iterations or the gradient norm drops below min_grad_norm.
+    """
+    parameters = dict(perplexity=perplexity, learning_rate=learning_rate, metric='precomputed', method='barnes_hut',
+                      angle=angle, n_iter_without_progress=n_iter_without_progress, min_grad_norm=min_grad_norm,
+                      init=init, random_state=random_state)
+    # the parameter was renamed in newer versions of scikit-learn
+    if 'max_iter' in inspect.signature(TSNE).parameters:
+        parameters['max_iter'] = max_iter
+    else:
+        parameters['n_iter'] = max_iter
+    return TSNE(**parameters)
+
+
+def tsne_projection(similarity_matrix, data, perplexity=30, learning_rate='auto', max_iter=1000,
+                    n_iter_without_progress=100, init='random', random_state=None):
+    """Returns t-SNE projection of the items.
+
+    EXAMPLE:
+        projection = tsne_projection(editdistance, data, perplexity=12)
+        projection.matplotlib_plot_with_manual_labels(annotate=False)
+
+    Parameters
+    ----------
+    similarity_matrix : DataFrame or sparse matrix
+        Similarity matrix, or sparse graph of distances to the nearest neighbours (e.g. from knn_distance_graph())
+        with at least 3 * perplexity neighbours of each item
+    data : DataFrame
+        All data (words) in the same order as the items of the similarity matrix
+    perplexity : float
+        Perplexity of t-SNE
+    learning_rate : float or 'auto'
+        Learning rate of t-SNE
+    max_iter : int
+        Maximum number of iterations of the optimization
+    n_iter_without_progress : int
+        Maximum number of iterations without progress (KL divergence) before the optimization is stopped
+    init : 'random' or numpy.ndarray
+        Initialization of the embedding
+    random_state : int
+        Seed of the random number generator
+
+    Returns
+    -------
+    Projection
+    """
+    if sparse.issparse(similarity_matrix):
+        graph = sparse.csr_matrix(similarity_matrix)
+    else:
+        distances = similarity_to_distance(similarity_matrix)
+        graph = knn_distance_graph(distances, neighbors_for_perplexity(perplexity, len(distances)))
+    model = create_tsne(perplexity, learning_rate, max_iter, n_iter_without_progress, init=init,
+                        random_state=random_state)
+    result = model.fit_transform(graph)
+    return Projection(result[:, 0], result[:, 1], data, model=model)
+
+
+def pca_initialization(distances, random_state=None):
+    """Returns PCA initialization of t-SNE (first two principal components of rows of the distance matrix).
+
+    It's scaled in the same way as the PCA initialization in scikit-learn.
+    """
+    init = PCA(n_components=2, svd_solver='randomized', random_state=random_state).fit_transform(distances)
+    return init / np.std(init[:, 0]) * 1e-4
+
+
+def _fit_embedding(arguments):
+    graph, perplexity, parameters = arguments
+    model = create_tsne(perplexity, **parameters)
+    return model.fit_transform(graph), model
+
+
+def _embedding_path(cache_dir, graph, perplexity, parameters):
+    """Returns path of the cached embedding, it's determined by the neighbour graph and the parameters of t-SNE."""
+    key = hashlib.sha1()
+    for array in (graph.indptr, graph.indices, graph.data, parameters['init']):
+        key.update(np.ascontiguousarray(array).tobytes())
+    key.update(repr((perplexity, sorted((name, value) for name, value in parameters.items()
+                                        if name != 'init'))).encode())
+    return os.path.join(cache_dir, 'tsne-%s.npy' % key.hexdigest())
+
+
+def tsne_perplexity_sweep(similarity_matrix, data, perplexities=(2, 5, 10, 20, 50, 100), learning_rate='auto',
+                          max_iter=1000, n_iter_without_progress=100, random_state=None, n_jobs=None, cache_dir=None):
+    """Returns t-SNE projections of the items for more perplexities.
+
+    The neighbour graph is computed only once (for the biggest perplexity), the affinities for each
+    perplexity are computed from its nearest neighbours in this graph. All projections start from the same
+    PCA initialization and they are computed in a process pool. If cache_dir is specified, each embedding
+    is saved there and it's loaded instead of the computation next time.
+
+    EXAMPLE:
+        projections = tsne_perplexity_sweep(word2vec, data, [2, 5, 10, 20, 50, 100], cache_dir='data/tsne')
+
+    Parameters
+    ----------
+    similarity_matrix : DataFrame
+        Similarity matrix
+    data : DataFrame
+        All data (words) in the same order as the items of the similarity matrix
+    perplexities : list of float
+        Perplexities of t-SNE, perplexities that are not lower than the number of items are left out
+    learning_rate : float or 'auto'
+        Learning rate of t-SNE
+    max_iter : int
+        Maximum number of iterations of the optimization
+    n_iter_without_progress : int
+        Maximum number of iterations without progress (KL divergence) before the optimization is stopped
+    random_state : int
+        Seed of the random number generator
+    n_jobs : int
+        Number of processes, all CPUs are used by default.
+    cache_dir : str
+        Directory where the embeddings are saved
+
+    Returns
+    -------
+    list of Projection
+        Projection for each used perplexity (model is None for the projections loaded from cache)
+    """
+    distances = similarity_to_distance(similarity_matrix)
+    # t-SNE requires perplexity lower than the number of items (small concepts have less than 100 items)
+    too_big = [perplexity for perplexity in perplexities if perplexity >= len(distances)]
+    if too_big:
+        print("Perplexities {} are not lower than the number of items ({}), they are left out.".format(
+            too_big, len(distances)))
+        perplexities = [perplexity for perplexity in perplexities if perplexity < len(distances)]
+    if not perplexities:
+        raise ValueError("There is no perplexity lower than the number of items ({}).".format(len(distances)))
+    graph = knn_distance_graph(distances, neighbors_for_perplexity(max(perplexities), len(distances)))
+    parameters = dict(learning_rate=learning_rate, max_iter=max_iter, n_iter_without_progress=n_iter_without_progress,
+                      init=pca_initialization(distances, random_state), random_state=random_state)
+
+    embeddings = {}
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        for perplexity in perplexities:
+            path = _embedding_path(cache_dir, graph, perplexity, parameters)
+            if os.path.exists(path):
+                embeddings[perplexity] = (np.load(path), None)
+
+    missing = [perplexity for perplexity in perplexities if perplexity not in embeddings]
+    tasks = [(graph, perplexity, parameters) for perplexity in missing]
+    if n_jobs is None:
+        n_jobs = multiprocessing.cpu_count()
+    if n_jobs > 1 and len(tasks) > 1:
+        with multiprocessing.Pool(min(n_jobs, len(tasks))) as pool:
+            results = pool.map(_fit_embedding, tasks)
+    else:
+        results = [_fit_embedding(task) for task in tasks]
+
+    for perplexity, (embedding, model) in zip(missing, results):
+        embeddings[perplexity] = (embedding, model)
+        if cache_dir is not None:
+            np.save(_embedding_path(cache_dir, graph, perplexity, parameters), embedding)
+
+    return [Projection(embeddings[perplexity][0][:, 0], embeddings[perplexity][0][:, 1], data,
+                       model=embeddings[perplexity][1])
+            for perplexity in perplexities]
+
+
+def conditional_probabilities(distances, perplexity, n_steps=100, tolerance=1e-5):
+    """Returns conditional probabilities p(j|i) of t-SNE for each row of distances (binary search of precision).
+
+    Only 3 * perplexity nearest items of each row get nonzero probability (as in Barnes-Hut t-SNE),
+    infinite distances get zero probability.
+    """
+    distances = np.array(distances, dtype=float, ndmin=2)
+    n_neighbors = min(distances.shape[1], int(3. * perplexity + 1))
+    nearest = np.argpartition(distances, n_neighbors - 1, axis=1)[:, :n_neighbors]
+    nearest_distances = np.take_along_axis(distances, nearest, axis=1)
+
+    desired_entropy = np.log(perplexity)
+    beta = np.ones(len(distances))
+    beta_min, beta_max = np.full(len(distances), -np.inf), np.full(len(distances), np.inf)
+    for _ in range(n_steps):
+        weights = np.exp(-nearest_distances * beta[:, np.newaxis])
+        weights_sum = np.maximum(weights.sum(axis=1), 1e-12)
+        probabilities = weights / weights_sum[:, np.newaxis]
+        entropy = np.log(weights_sum) + beta * np.nansum(nearest_distances * probabilities, axis=1)
+        difference = entropy - desired_entropy
+        if np.all(np.abs(difference) <= tolerance):
+            break
+        # too high entropy -> higher precision
+        higher = difference > 0
+        beta_min = np.where(higher, beta, beta_min)
+        beta_max = np.where(higher, beta_max, beta)
+        beta = np.where(higher, np.where(np.isinf(beta_max), beta * 2, (beta + beta_max) / 2),
+                        np.where(np.isinf(beta_min), beta / 2, (beta + beta_min) / 2))
+
+    result = np.zeros(distances.shape)
+    np.put_along_axis(result, nearest, np.nan_to_num(probabilities), axis=1)
+    return result
+
+
+def embed_new_items(positions, distances, perplexity=30, n_iter=300, learning_rate=1, momentum=0.8):
+    """Returns positions of new items in an existing t-SNE embedding, the existing positions are fixed.
+
+    Each new item is initialized at the weighted average of its neighbours and then only its position
+    is optimized (KL divergence of its conditional probabilities of the existing items).
+
+    Parameters
+    ----------
+    positions : numpy.ndarray
+        Positions of the existing items (n x 2)
+    distances : numpy.ndarray
+        Distances of the new items (rows) to the existing items (columns)
+    perplexity : float
+        Perplexity of t-SNE
+    n_iter : int
+        Maximum number of iterations of the optimization (it stops sooner, when the positions don't change)
+    learning_rate : float
+        Learning rate of the gradient descent
+    momentum : float
+        Momentum of the gradient descent
+
+    Returns
+    -------
+    numpy.ndarray
+        Positions of the new items (m x 2)
+    """
+    positions = np.asarray(positions, dtype=float)
+    p = conditional_probabilities(distances, perplexity)
+    new_positions = p @ positions
+    update = np.zeros(new_positions.shape)
+    for _ in range(n_iter):
+        difference = new_positions[:, np.newaxis, :] - positions[np.newaxis, :, :]
+        kernel = 1 / (1 + np.sum(difference ** 2, axis=2))
+        q = kernel / kernel.sum(axis=1, keepdims=True)
+        gradient = 4 * np.einsum('ij,ijk->ik', (p - q) * kernel, difference)
+        update = momentum * update - learning_rate * gradient
+        new_positions += update
+        if np.abs(update).max() < 1e-6:
+            break
+    return new_positions
@@ -0,0 +1,195 @@
+"""
+Engine for computing pairwise similarity matrices based on Edit distance.
+
+Only the upper triangle of the matrix is computed (Edit distance is symmetric and every word is identical
+to itself), identical words are computed just once and blocks of rows are distributed across a process pool.
+Similarities with more thresholds M are derived from a single pass of bounded Edit distance.
+"""
+
+import multiprocessing
+from functools import partial
+import numpy as np
+import pandas as pd
+from similarities.text_similarities import levenshtein_similarity, bounded_edit_distance
+
+# below this number of distinct words the pool overhead is bigger than the computation itself
+MIN_WORDS_FOR_POOL = 300
+
+# state of the worker processes (set by _init_worker, so the words are not sent with every block)
+_words = None
+_function = None
+
+
+def _init_worker(words, similarity_function):
+    global _words, _function
+    _words = words
+    _function = similarity_function
+
+
+def _compute_rows(bounds):
+    """Computes the upper triangle part of rows [start, stop) and returns it as one flat array."""
+    start, stop = bounds
+    n = len(_words)
+    values = np.empty(sum(n - i - 1 for i in range(start, stop)))
+    position = 0
+    for i in range(start, stop):
+        word = _words[i]
+        for j in range(i + 1, n):
+            values[position] = _function(word, _words[j])
+            position += 1
+    return start, stop, values
+
+
+def _row_blocks(n, n_blocks):
+    """Splits rows of the upper triangle into blocks with approximately the same number of pairs.
+
+    >>> _row_blocks(4, 2)
+    [(0, 1), (1, 4)]
+    """
+    pairs = np.cumsum(np.arange(n - 1, -1, -1))
+    bounds = np.searchsorted(pairs, np.linspace(0, pairs[-1], n_blocks + 1)[1:-1], side='right')
+    bounds = [0] + sorted(set(bounds.tolist()) - {0, n}) + [n]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _pairwise_array(words, function, n_jobs=None, diagonal=1.0):
+    """Returns symmetric matrix of function values for each pair of words, only the upper triangle is computed."""
+    words = list(words)
+    n = len(words)
+    matrix = np.zeros((n, n))
+    if n_jobs is None:
+        n_jobs = multiprocessing.cpu_count()
+
+    if n_jobs > 1 and n >= MIN_WORDS_FOR_POOL:
+        # more blocks than processes, so the processes are balanced
+        blocks = _row_blocks(n, 4 * n_jobs)
+        with multiprocessing.Pool(n_jobs, initializer=_init_worker, initargs=(words, function)) as pool:
+            results = list(pool.imap_unordered(_compute_rows, blocks))
+    else:
+        _init_worker(words, function)
+        results = [_compute_rows((0, n))]
+        _init_worker(None, None)
+
+    for start, stop, values in results:
+        position = 0
+        for i in range(start, stop):
+            matrix[i, i + 1:] = values[position:position + n - i - 1]
+            position += n - i - 1
+
+    matrix += matrix.T
+    np.fill_diagonal(matrix, diagonal)
+    return matrix
+
+
+def edit_similarity_array(words, similarity_function=levenshtein_similarity, n_jobs=None, **kwargs):
+    """Returns pairwise similarity matrix of (distinct) words as a float64 NumPy array.
+
+    Parameters
+    ----------
+    words : list of str
+        Words that are used for similarity matrix computation
+    similarity_function : function
+        Function that is used for similarity computation between words
+        It has to be a module-level function (picklable), if more processes are used.
+    n_jobs : int
+        Number of processes, all CPUs are used by default.
+    **kwargs
+        Additional parameters of similarity_function, e.g. M for levenshtein_similarity_with_threshold()
+
+    Returns
+    -------
+    numpy.ndarray
+    """
+    if kwargs:
+        similarity_function = partial(similarity_function, **kwargs)
+    return _pairwise_array(words, similarity_function, n_jobs)
+
+
+def bounded_edit_distance_array(words, M, n_jobs=None):
+    """Returns pairwise Edit distances of (distinct) words bounded by M (min(distance, M)) as a NumPy array."""
+    return _pairwise_array(words, partial(bounded_edit_distance, M=M), n_jobs, diagonal=0.0)
+
+
+def compute_edit_similarity_matrix(index, solutions, similarity_function=levenshtein_similarity, n_jobs=None,
+                                   **kwargs):
+    """Returns pairwise similarity matrix computed by using Edit distance (between each pair of words).
+
+    Identical solutions are computed only once and then expanded to all their items.
+
+    Parameters
+    ----------
+    index : list of int
+        Index and columns of pairwise similarity matrix
+    solutions : list of str
+        Words that are used for similarity matrix computation
+    similarity_function : function
+        Function that is used for similarity computation between words
+        Levenshtein similarity by default.
+    n_jobs : int
+        Number of processes, all CPUs are used by default.
+    **kwargs
+        Additional parameters of similarity_function, e.g. M for levenshtein_similarity_with_threshold()
+
+    Returns
+    -------
+    DataFrame
+    """
+    codes, words = pd.factorize(pd.Series(list(solutions), dtype=object))
+    matrix = edit_similarity_array(words, similarity_function, n_jobs, **kwargs)
+    return pd.DataFrame(matrix[np.ix_(codes, codes)], index=index, columns=index)
+
+
+def compute_edit_similarity_matrices_with_thresholds(index, solutions, thresholds=(3, 4, 5, 6, 7, 8), n_jobs=None):
+    """Returns similarity matrices of levenshtein_similarity_with_threshold() for more thresholds at once.
+
+    Edit distances are computed only once (bounded by the biggest threshold),
+    the similarity matrix for each threshold M is then derived as 1 - min(distance, M) / M.
+
+    Parameters
+    ----------
+    index : list of int
+        Index and columns of pairwise similarity matrices
+    solutions : list of str
+        Words that are used for similarity matrix computation
+    thresholds : list of int
+        Thresholds M of levenshtein_similarity_with_threshold()
+    n_jobs : int
+        Number of processes, all CPUs are used by default.
+
+    Returns
+    -------
+    dict of (int, DataFrame)
+        Similarity matrix for each threshold
+    """
+    codes, words = pd.factorize(pd.Series(list(solutions), dtype=object))
+    distances = bounded_edit_distance_array(words, max(thresholds), n_jobs)[np.ix_(codes, codes)]
+    return {M: pd.DataFrame(1 - np.minimum(distances, M) / M, index=index, columns=index) for M in thresholds}
+
+
+def compute_edit_similarity_rows(new_index, new_solutions, index, solutions, similarity_function=levenshtein_similarity,
+                                 **kwargs):
+    """Returns rows of the pairwise similarity matrix only for new items (similarities with the existing items).
+
+    Parameters
+    ----------
+    new_index : list of int
+        Index of new items (rows of the result)
+    new_solutions : list of str
+        Words of new items
+    index : list of int
+        Index of existing items (columns of the result)
+    solutions : list of str
+        Words of existing items
+    similarity_function : function
+        Function that is used for similarity computation between words
+        Levenshtein similarity by default.
+    **kwargs
+        Additional parameters of similarity_function, e.g. M for levenshtein_similarity_with_threshold()
+
+    Returns
+    -------
+    DataFrame
+    """
+    rows = np.array([[similarity_function(new_word, word, **kwargs) for word in solutions]
+                     for new_word in new_solutions], dtype=float).reshape(len(new_solutions), len(solutions))
+    return pd.DataFrame(rows, index=new_index, columns=index)
@@ -0,0 +1,137 @@
+"""
+Incremental Pearson similarity of questions, which is updated by batches of new answers.
+
+For each pair of questions answered by the same user the sufficient statistics of Pearson correlation are kept
+(number of co-answers, sums of values and sums of products and squares). A new answer adds its pairs with the
+previous answers of its user, so a batch is processed in time proportional to its size (and the histories
+of its users), without reading the whole log again.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from similarities.performance_similarities import pearson_from_moments
+
+# pairs of positions of questions (a, b) are stored as keys a * _KEY_BASE + b
+_KEY_BASE = 2 ** 31
+
+
+class IncrementalPearson():
+    """Accumulator of pairwise-complete Pearson similarity of questions (same as pearson_similarity() of
+    the correctness matrix, i.e. only the first answer of the user to the question is used).
+
+    EXAMPLE:
+        similarity = IncrementalPearson()
+        similarity.update(ps_data)
+        ...
+        similarity.update(new_answers)
+        pearson = similarity.similarity_matrix()
+    """
+
+    def __init__(self, min_periods=1):
+        """Initialization of the accumulator.
+
+        Parameters
+        ----------
+        min_periods : int
+            Minimum number of users who answered both questions required to have a valid similarity
+        """
+        self.min_periods = min_periods
+        self.positions = {}
+        self.question_ids = []
+        # first answers of each user, dict of (position of question, correctness)
+        self.history = {}
+        # statistics of pairs (n, sum_x, sum_xy, sum_xx) merged from batches, when there are enough of them
+        self._keys = np.array([], dtype=np.int64)
+        self._statistics = np.zeros((4, 0))
+        self._batches = []
+        self._batches_size = 0
+
+    def _question_positions(self, question_ids):
+        for question_id in pd.unique(question_ids):
+            if question_id not in self.positions:
+                self.positions[question_id] = len(self.question_ids)
+                self.question_ids.append(question_id)
+        return np.array([self.positions[question_id] for question_id in question_ids], dtype=np.int64)
+
+    def update(self, data):
+        """Adds new answers.
+
+        Parameters
+        ----------
+        data : DataFrame
+            New rows of the log of answers (in the order of time) that contain 'user', 'question_id', 'correct'
+        """
+        data = data.drop_duplicates(['user', 'question_id'], keep='first')
+        positions = self._question_positions(data['question_id'].values)
+        values = data['correct'].values.astype(float)
+        keys, statistics = [], []
+
+        for user, rows in data.groupby('user', sort=False).indices.items():
+            history = self.history.setdefault(user, {})
+            new = [row for row in rows if positions[row] not in history]
+            if not new:
+                continue
+            old_positions = np.fromiter(history.keys(), dtype=np.int64, count=len(history))
+            old_values = np.fromiter(history.values(), dtype=float, count=len(history))
+            history.update(zip(positions[new], values[new]))
+            new_positions, new_values = positions[new], values[new]
+            # answers without correctness (NaN) count as answered, but they are not used
+            old_valid, new_valid = ~np.isnan(old_values), ~np.isnan(new_values)
+            old_positions, old_values = old_positions[old_valid], old_values[old_valid]
+            new_positions, new_values = new_positions[new_valid], new_values[new_valid]
+
+            # pairs (new, new or old) and (old, new)
+            all_positions = np.concatenate([old_positions, new_positions])
+            all_values = np.concatenate([old_values, new_values])
+            k_new, k_old, k_all = len(new_positions), len(old_positions), len(all_positions)
+            a = np.concatenate([np.repeat(new_positions, k_all), np.tile(old_positions, k_new)])
+            b = np.concatenate([np.tile(all_positions, k_new), np.repeat(new_positions, k_old)])
+            x = np.concatenate([np.repeat(new_values, k_all), np.tile(old_values, k_new)])
+            y = np.concatenate([np.tile(all_values, k_new), np.repeat(new_values, k_old)])
+            keys.append(a * _KEY_BASE + b)
+            statistics.append(np.vstack([np.ones(len(x)), x, x * y, x * x]))
+
+        if keys:
+            self._batches.append((np.concatenate(keys), np.hstack(statistics)))
+            self._batches_size += len(self._batches[-1][0])
+            # batches are merged when they are bigger than the merged statistics (amortized linear time)
+            if self._batches_size > len(self._keys):
+                self._merge()
+
+    def _merge(self):
+        if not self._batches:
+            return
+        keys = np.concatenate([self._keys] + [batch_keys for batch_keys, _ in self._batches])
+        statistics = np.hstack([self._statistics] + [batch_statistics for _, batch_statistics in self._batches])
+        self._keys, inverse = np.unique(keys, return_inverse=True)
+        self._statistics = np.vstack([np.bincount(inverse.ravel(), weights=statistic, minlength=len(self._keys))
+                                      for statistic in statistics])
+        self._batches, self._batches_size = [], 0
+
+    def _statistics_matrices(self):
+        """Returns sparse matrices (CSR) of n, sum_x, sum_xy and sum_xx of all pairs of questions."""
+        self._merge()
+        n = len(self.question_ids)
+        rows, columns = self._keys // _KEY_BASE, self._keys % _KEY_BASE
+        return [sparse.csr_matrix((statistic, (rows, columns)), shape=(n, n)) for statistic in self._statistics]
+
+    def similarity_matrix(self):
+        """Returns current Pearson similarity matrix (questions sorted by question_id)."""
+        order = np.argsort(self.question_ids, kind='stable')
+        n, sum_x, sum_xy, sum_xx = (statistic[order][:, order].toarray() for statistic in self._statistics_matrices())
+        index = pd.Index(np.asarray(self.question_ids)[order], name='question_id')
+        return pd.DataFrame(pearson_from_moments(n, sum_x, sum_xy, sum_xx, self.min_periods),
+                            index=index, columns=index)
+
+    def similarity_rows(self, question_ids):
+        """Returns rows of current Pearson similarity matrix only for the questions."""
+        order = np.argsort(self.question_ids, kind='stable')
+        rows = np.array([self.positions[question_id] for question_id in question_ids], dtype=np.int64)
+        n, sum_x, sum_xy, sum_xx = self._statistics_matrices()
+        sum_y, sum_yy = sum_x.T.tocsr(), sum_xx.T.tocsr()
+        n, sum_x, sum_xy, sum_xx, sum_y, sum_yy = (statistic[rows][:, order].toarray()
+                                                   for statistic in (n, sum_x, sum_xy, sum_xx, sum_y, sum_yy))
+        return pd.DataFrame(pearson_from_moments(n, sum_x, sum_xy, sum_xx, self.min_periods, sum_y, sum_yy),
+                            index=pd.Index(question_ids, name='question_id'),
+                            columns=pd.Index(np.asarray(self.question_ids)[order], name='question_id'))
@@ -0,0 +1,229 @@
+"""
+Persistent on-disk store of similarity matrices.
+
+Matrices are keyed by the measure, its parameters and the set of items. Each matrix is saved as a float32
+.npy file (together with its index), so it can be opened read-only with memory mapping by any process.
+When items are added or removed, only the rows of the new items are computed and the stored matrix is patched.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+
+def _key(value):
+    return hashlib.sha1(value).hexdigest()[:16]
+
+
+def parameters_key(parameters):
+    """Returns key of the parameters of the measure (e.g. {'M': 4})."""
+    return _key(json.dumps(parameters or {}, sort_keys=True, default=str).encode())
+
+
+def items_key(index):
+    """Returns key of the set of items (the order and the integer type of the items don't matter)."""
+    items = pd.Index(index)
+    if pd.api.types.is_integer_dtype(items) or pd.api.types.infer_dtype(items) == 'integer':
+        # compact data have question_id as int8 or int16
+        return _key(np.sort(items.astype(np.int64).values).tobytes())
+    # other items (e.g. strings) by their values, bytes of object arrays would be pointers
+    return _key(json.dumps(sorted(items.tolist()), default=str).encode())
+
+
+class SimilarityMatrixStore():
+    """Store of similarity matrices in a directory (root/measure/parameters/items/{matrix.npy, index.npy}).
+
+    Each version of a matrix is written to its own hidden directory and items is a symbolic link to the current
+    version, so a matrix is replaced at once by replacing the link (readers never see a new index with an old
+    matrix and concurrent writers don't share any file).
+    """
+
+    def __init__(self, path='data/similarity_matrices', dtype=np.float32, block_size=1024):
+        """Initialization of the store.
+
+        Parameters
+        ----------
+        path : str
+            Root directory of the store
+        dtype : numpy dtype
+            Type of the stored values
+        block_size : int
+            Number of rows copied at once, when the matrix is patched
+        """
+        self.path = path
+        self.dtype = dtype
+        self.block_size = block_size
+
+    def _parameters_path(self, measure, parameters):
+        return os.path.join(self.path, measure, parameters_key(parameters))
+
+    def _matrix_path(self, measure, parameters, index):
+        return os.path.join(self._parameters_path(measure, parameters), items_key(index))
+
+    def contains(self, measure, parameters, index):
+        """Returns True if the matrix for the measure, parameters and the set of items is stored."""
+        return os.path.exists(os.path.join(self._matrix_path(measure, parameters, index), 'matrix.npy'))
+
+    def _open(self, path, attempts=10):
+        for attempt in range(attempts):
+            # all files are read from the same version
+            version_path = os.path.realpath(path)
+            try:
+                matrix = np.load(os.path.join(version_path, 'matrix.npy'), mmap_mode='r')
+                with open(os.path.join(version_path, 'index.json')) as f:
+                    name = json.load(f)['name']
+                index = pd.Index(np.load(os.path.join(version_path, 'index.npy')), name=name)
+                return pd.DataFrame(matrix, index=index, columns=index, copy=False)
+            except FileNotFoundError:
+                # the version was replaced and removed by another process in the meantime
+                if attempt == attempts - 1:
+                    raise
+
+    def load(self, measure, parameters, index):
+        """Returns stored similarity matrix (read-only and memory mapped, values aren't copied) or None.
+
+        Parameters
+        ----------
+        measure : str
+            Name of the measure, e.g. 'editdistance'
+        parameters : dict
+            Parameters of the measure
+        index : list of int
+            Items of the matrix (the matrix is returned in the stored order of the items)
+
+        Returns
+        -------
+        DataFrame
+        """
+        if not self.contains(measure, parameters, index):
+            return None
+        return self._open(self._matrix_path(measure, parameters, index))
+
+    def _write(self, measure, parameters, index, fill):
+        """Writes matrix of the items, values are written by fill(matrix) into the memory mapped file."""
+        path = self._matrix_path(measure, parameters, index)
+        parameters_path, name = os.path.split(path)
+        os.makedirs(parameters_path, exist_ok=True)
+        version_path = tempfile.mkdtemp(prefix='.' + name + '-', dir=parameters_path)
+        try:
+            matrix = np.lib.format.open_memmap(os.path.join(version_path, 'matrix.npy'), mode='w+',
+                                               dtype=self.dtype, shape=(len(index),) * 2)
+            fill(matrix)
+            matrix.flush()
+            del matrix
+            np.save(os.path.join(version_path, 'index.npy'), np.asarray(index))
+            with open(os.path.join(version_path, 'index.json'), 'w') as f:
+                json.dump({'name': getattr(index, 'name', None), 'measure': measure, 'parameters': parameters}, f,
+                          default=str)
+            self._replace_version(path, version_path)
+        except BaseException:
+            shutil.rmtree(version_path, ignore_errors=True)
+            raise
+        return self._open(path)
+
+    def _replace_version(self, path, version_path):
+        """Points the link path to the directory version_path and removes the previous version."""
+        link_path = version_path + '.link'
+        os.symlink(os.path.basename(version_path), link_path)
+        # replacements of the same matrix are serialized, so each of them removes exactly the previous version
+        with open(os.path.join(os.path.dirname(path), '.' + os.path.basename(path) + '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            old_path = os.path.realpath(path) if os.path.islink(path) else None
+            try:
+                # the matrix is visible to the other processes only when it's complete
+                os.replace(link_path, path)
+            except IsADirectoryError:
+                # matrix written by an older version of the store (a directory instead of a link)
+                shutil.rmtree(path, ignore_errors=True)
+                os.replace(link_path, path)
+            if old_path is not None:
+                # processes that have the old matrix memory mapped keep it until they close it
+                shutil.rmtree(old_path, ignore_errors=True)
+
+    def save(self, measure, parameters, matrix):
+        """Saves similarity matrix (DataFrame) and returns its stored (memory mapped) version."""
+        def fill(stored):
+            for start in range(0, len(matrix), self.block_size):
+                stored[start:start + self.block_size] = matrix.values[start:start + self.block_size]
+        return self._write(measure, parameters, matrix.index, fill)
+
+    def _closest_stored(self, measure, parameters, index):
+        """Returns the stored matrix (memory mapped) that has the most items in common with index or None."""
+        parameters_path = self._parameters_path(measure, parameters)
+        if not os.path.isdir(parameters_path):
+            return None
+        best, best_overlap = None, 0
+        for name in os.listdir(parameters_path):
+            path = os.path.join(parameters_path, name)
+            # versions are read through their links
+            if name.startswith('.'):
+                continue
+            if not os.path.exists(os.path.join(path, 'matrix.npy')):
+                continue
+            stored = self._open(path)
+            overlap = np.isin(stored.index.values, index).sum()
+            if overlap > best_overlap:
+                best, best_overlap = stored, overlap
+        return best
+
+    def get(self, measure, parameters, index, compute_rows):
+        """Returns similarity matrix of the items, only the missing rows are computed.
+
+        If the matrix isn't stored, the stored matrix (with the same measure and parameters) that has
+        the most items in common is patched: rows and columns of the removed items are left out
+        and only the rows of the new items are computed. The matrix has to be symmetric.
+
+        EXAMPLE:
+            solutions = data.set_index('question_id')['solution']
+            def compute_rows(rows, columns):
+                return compute_edit_similarity_rows(rows, solutions[rows], columns, solutions[columns]).values
+            editdistance = store.get('editdistance', {}, data['question_id'], compute_rows)
+
+        Parameters
+        ----------
+        measure : str
+            Name of the measure, e.g. 'editdistance'
+        parameters : dict
+            Parameters of the measure
+        index : list of int
+            Items of the matrix
+        compute_rows : function
+            compute_rows(rows, columns) returns array of similarities of items rows (rows) with items columns (columns)
+
+        Returns
+        -------
+        DataFrame
+            Read-only memory mapped similarity matrix
+        """
+        index = pd.Index(index)
+        if self.contains(measure, parameters, index):
+            return self.load(measure, parameters, index)
+
+        stored = self._closest_stored(measure, parameters, index)
+        if stored is None:
+            def fill(matrix):
+                for start in range(0, len(index), self.block_size):
+                    matrix[start:start + self.block_size] = compute_rows(index[start:start + self.block_size], index)
+            return self._write(measure, parameters, index, fill)
+
+        # matrix and index of the same version
+        stored_positions = stored.index.get_indexer(index)
+        stored = stored.values
+        kept = np.flatnonzero(stored_positions >= 0)
+        new = np.flatnonzero(stored_positions < 0)
+
+        def fill(matrix):
+            for start in range(0, len(kept), self.block_size):
+                rows = kept[start:start + self.block_size]
+                block = stored[stored_positions[rows]][:, stored_positions[kept]]
+                matrix[rows[:, np.newaxis], kept] = block
+            if len(new) > 0:
+                new_rows = np.asarray(compute_rows(index[new], index), dtype=self.dtype)
+                matrix[new] = new_rows
+                matrix[:, new] = new_rows.T
+        return self._write(measure, parameters, index, fill)
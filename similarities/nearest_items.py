@@ -0,0 +1,262 @@
+"""
+Indexes of the most similar items (k nearest neighbours) for each similarity measure.
+
+Instead of dense n x n similarity matrices, the indexes answer queries for the k most similar items
+and build sparse k-NN graphs, which can be used directly by t-SNE (tsne_projection())
+or as connectivity of clustering (AgglomerativeClustering(connectivity=graph)).
+"""
+
+import heapq
+import math
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from similarities.text_similarities import bounded_edit_distance
+from similarities.performance_similarities import pearson_similarity_rows, to_sparse_correctness_matrix
+
+
+def _top_k(similarities, k, excluded=None):
+    """Returns positions and values of k highest similarities in each row (sorted), NaNs are ignored.
+
+    excluded : positions (one for each row) that can't be in the result (the item itself)
+    """
+    similarities = np.array(similarities, dtype=float, ndmin=2)
+    similarities[np.isnan(similarities)] = -np.inf
+    if excluded is not None:
+        similarities[np.arange(len(similarities)), excluded] = -np.inf
+    k = min(k, similarities.shape[1])
+    positions = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    values = np.take_along_axis(similarities, positions, axis=1)
+    order = np.argsort(-values, axis=1, kind='stable')
+    return np.take_along_axis(positions, order, axis=1), np.take_along_axis(values, order, axis=1)
+
+
+class NearestItems():
+    """Base class of the indexes, subclasses implement _neighbors(positions, k)."""
+
+    def __init__(self, index):
+        self.index = pd.Index(index)
+
+    def _neighbors(self, positions, k):
+        """Returns positions and similarities of k most similar items (without the item itself) for each position."""
+        raise NotImplementedError
+
+    def most_similar(self, item, k=10):
+        """Returns k most similar items to the item.
+
+        Parameters
+        ----------
+        item : int
+            Item (question_id) from the index
+        k : int
+            Number of the most similar items
+
+        Returns
+        -------
+        Series
+            Similarities of the most similar items (sorted from the most similar)
+        """
+        neighbors, similarities = self._neighbors(np.array([self.index.get_loc(item)]), k)
+        valid = np.isfinite(similarities[0])
+        return pd.Series(similarities[0][valid], index=self.index[neighbors[0][valid]], name=item)
+
+    def kneighbors_graph(self, k=10, block_size=1024):
+        """Returns sparse k-NN graph of distances (1 - similarity).
+
+        Each row contains the item itself (with zero distance) and its k nearest items sorted by distance,
+        which is the form of precomputed neighbours that scikit-learn (and tsne_projection()) expects.
+
+        Parameters
+        ----------
+        k : int
+            Number of nearest items of each item
+        block_size : int
+            Number of items processed at once
+
+        Returns
+        -------
+        scipy.sparse.csr_matrix
+        """
+        n = len(self.index)
+        k = min(k, n - 1)
+        columns = np.empty((n, k + 1), dtype=np.intp)
+        distances = np.zeros((n, k + 1))
+        for start in range(0, n, block_size):
+            positions = np.arange(start, min(start + block_size, n))
+            neighbors, similarities = self._neighbors(positions, k)
+            columns[positions, 0] = positions
+            columns[positions, 1:] = neighbors
+            distances[positions, 1:] = np.clip(1 - similarities, 0, None)
+        # items without enough similar items (e.g. only NaN similarities) get the biggest distance
+        distances[~np.isfinite(distances)] = 2
+        indptr = np.arange(0, n * (k + 1) + 1, k + 1)
+        return sparse.csr_matrix((distances.ravel(), columns.ravel(), indptr), shape=(n, n))
+
+
+class Word2VecNearestItems(NearestItems):
+    """Exact cosine k-NN index of word vectors (e.g. from get_word2vec_items())."""
+
+    def __init__(self, vectors, index):
+        """Initialization of the index.
+
+        Parameters
+        ----------
+        vectors : list of word vectors
+            Word vectors in the same order as index
+        index : list of int
+            Items (question_id) of the vectors
+        """
+        super().__init__(index)
+        vectors = np.array(vectors, dtype=np.float32, ndmin=2)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        self.vectors = vectors / norms
+
+    def _neighbors(self, positions, k):
+        return _top_k(self.vectors[positions] @ self.vectors.T, k, positions)
+
+
+def _qgrams(word, q):
+    """Returns q-grams of the padded word, repeated q-grams are numbered (so they are distinct).
+
+    >>> _qgrams('aaa', 2)
+    [('#a', 1), ('aa', 1), ('aa', 2), ('a$', 1)]
+    """
+    padded = '#' * (q - 1) + word + '$' * (q - 1)
+    counts = {}
+    qgrams = []
+    for i in range(len(padded) - q + 1):
+        qgram = padded[i:i + q]
+        counts[qgram] = counts.get(qgram, 0) + 1
+        qgrams.append((qgram, counts[qgram]))
+    return qgrams
+
+
+class EditDistanceNearestItems(NearestItems):
+    """k-NN index of solutions by Levenshtein similarity (levenshtein_similarity() or its version with threshold M).
+
+    Edit distance is bounded from below by the number of q-grams (and characters) that words don't share
+    (one edit changes at most q q-grams), the bound is computed for all words at once by a sparse matrix product.
+    Exact (bounded) Edit distance is computed only for words, whose upper bound of similarity
+    is higher than the similarity of the k-th most similar item found so far.
+    """
+
+    def __init__(self, solutions, index, M=None, q=2):
+        """Initialization of the index.
+
+        Parameters
+        ----------
+        solutions : list of str
+            Words in the same order as index
+        index : list of int
+            Items (question_id) of the words
+        M : int
+            Threshold of levenshtein_similarity_with_threshold(), levenshtein_similarity() is used by default.
+        q : int
+            Length of q-grams
+        """
+        super().__init__(index)
+        self.solutions = np.asarray(list(solutions), dtype=object)
+        self.M = M
+        self.q = q
+        self.word_codes, self.words = pd.factorize(pd.Series(self.solutions, dtype=object))
+        self.items_by_word = pd.Series(np.arange(len(self.solutions))).groupby(self.word_codes).apply(np.array)
+        self.lengths = np.array([len(word) for word in self.words])
+
+        # characters (1-grams) bound the distance of words with different letters, q-grams of words with
+        # different order of letters
+        self.qgrams = {n: self._qgrams_matrix(n) for n in {1, q}}
+
+    def _qgrams_matrix(self, q):
+        """Returns sparse binary matrix of q-grams (columns) of the words (rows)."""
+        vocabulary = {}
+        columns = [[vocabulary.setdefault(qgram, len(vocabulary)) for qgram in _qgrams(word, q)]
+                   for word in self.words]
+        indptr = np.cumsum([0] + [len(c) for c in columns])
+        indices = np.fromiter((c for word_columns in columns for c in word_columns), dtype=np.int64, count=indptr[-1])
+        return sparse.csr_matrix((np.ones(len(indices), dtype=np.int32), indices, indptr),
+                                 shape=(len(self.words), len(vocabulary)))
+
+    def _similarity(self, distance, length):
+        """Returns similarity of words with the Edit distance, length is the length of the longer word."""
+        if self.M is not None:
+            return 1 - np.minimum(distance, self.M) / self.M
+        return 1 - distance / np.maximum(length, 1)
+
+    def _word_neighbors(self, code, k):
+        """Returns items and similarities of the k + (number of items of the word) most similar items of the word."""
+        word, length = self.words[code], self.lengths[code]
+        needed = k + len(self.items_by_word[code])
+        longer = np.maximum(length, self.lengths)
+        lower_bound = np.abs(self.lengths - length)
+        for q, qgrams in self.qgrams.items():
+            shared = (qgrams[code] @ qgrams.T).toarray().ravel()
+            lower_bound = np.maximum(lower_bound, np.ceil((longer + q - 1 - shared) / q))
+        upper_bound = self._similarity(lower_bound, longer)
+
+        heap = []
+        n_items = 0
+        for other in np.argsort(-upper_bound, kind='stable'):
+            full = n_items >= needed
+            if full and upper_bound[other] <= heap[0][0]:
+                break
+            if self.M is not None:
+                bound = self.M
+            elif full:
+                # bigger distance can't make the word more similar than the k-th item
+                bound = math.ceil((1 - heap[0][0]) * longer[other])
+            else:
+                bound = max(longer[other], 1)
+            distance = bounded_edit_distance(word, self.words[other], bound)
+            similarity = self._similarity(distance, longer[other])
+            if full and (similarity <= heap[0][0] or distance >= bound):
+                continue
+            heapq.heappush(heap, (similarity, -other))
+            n_items += len(self.items_by_word[other])
+            # the least similar words are not needed, if there are enough items without them
+            while n_items - len(self.items_by_word[-heap[0][1]]) >= needed:
+                n_items -= len(self.items_by_word[-heapq.heappop(heap)[1]])
+
+        items, similarities = [], []
+        for similarity, other in sorted(heap, reverse=True):
+            other_items = self.items_by_word[-other]
+            items.extend(other_items)
+            similarities.extend([similarity] * len(other_items))
+        return np.array(items[:needed], dtype=np.intp), np.array(similarities[:needed])
+
+    def _neighbors(self, positions, k):
+        neighbors = np.zeros((len(positions), k), dtype=np.intp)
+        similarities = np.full((len(positions), k), -np.inf)
+        cache = {}
+        for row, position in enumerate(positions):
+            code = self.word_codes[position]
+            if code not in cache:
+                cache[code] = self._word_neighbors(code, k)
+            items, values = cache[code]
+            other = items != position
+            items, values = items[other][:k], values[other][:k]
+            neighbors[row, :len(items)] = items
+            similarities[row, :len(items)] = values
+        return neighbors, similarities
+
+
+class PearsonNearestItems(NearestItems):
+    """k-NN index of questions by Pearson similarity of the sparse correctness matrix (co-answers of users)."""
+
+    def __init__(self, matrix, min_periods=1):
+        """Initialization of the index.
+
+        Parameters
+        ----------
+        matrix : DataFrame or SparseCorrectnessMatrix
+            Correctness matrix (output of reshape_to_correctness_matrix())
+        min_periods : int
+            Minimum number of users who answered both questions required to have a valid similarity
+        """
+        self.correctness = to_sparse_correctness_matrix(matrix)
+        super().__init__(self.correctness.questions)
+        self.min_periods = min_periods
+
+    def _neighbors(self, positions, k):
+        rows = pearson_similarity_rows(self.correctness, self.index[positions], self.min_periods)
+        return _top_k(rows.values, k, positions)
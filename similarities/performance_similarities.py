@@ -1,15 +1,72 @@
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+SparseCorrectnessMatrix = namedtuple('SparseCorrectnessMatrix', ['answered', 'correct', 'users', 'questions'])
+SparseCorrectnessMatrix.__doc__ = """Correctness matrix stored as two sparse matrices (users are rows, questions are columns).
+
+answered : scipy.sparse.csc_matrix
+    1 where the user answered the question
+correct : scipy.sparse.csc_matrix
+    Correctness of the answer (only answered questions can have nonzero value)
+users : Index
+    Users (rows) of the matrices
+questions : Index
+    Questions (columns) of the matrices
+"""
+
+
+def prune_nans(similarity_matrix):
+    """Removes NaN values from matrix and returns the matrix together with the dropped items.
+
+    Item (row and column with the same label) that has the most NaNs is dropped until there are no NaNs.
+    NaN counts are kept in an array and only decreased by the NaNs of the dropped row,
+    the matrix itself is sliced just once at the end.
+
+    Parameters
+    ----------
+    similarity_matrix : DataFrame
+        Square matrix with the same labels in the index and columns
+
+    Returns
+    -------
+    tuple of (DataFrame, DataFrame)
+        Matrix without NaN values and dropped items (in order of dropping) with the number of NaNs
+        in their column at the time they were dropped
+    """
+    mask = similarity_matrix.isnull().values
+    nans = mask.sum(axis=0)
+    rows = similarity_matrix.index.get_indexer(similarity_matrix.columns)
+    dropped = np.zeros(len(nans), dtype=bool)
+    dropped_columns, dropped_nans = [], []
+
+    while True:
+        # the first column with the most NaNs (same as idxmax)
+        column = np.argmax(np.where(dropped, -1, nans))
+        if dropped[column] or nans[column] == 0:
+            break
+        dropped_columns.append(column)
+        dropped_nans.append(nans[column])
+        dropped[column] = True
+        nans -= mask[rows[column]]
+
+    kept_rows = np.ones(len(similarity_matrix.index), dtype=bool)
+    kept_rows[rows[dropped]] = False
+    dropped_items = pd.DataFrame({'item': similarity_matrix.columns[dropped_columns],
+                                  'nans': np.array(dropped_nans, dtype=int)})
+    return similarity_matrix.iloc[kept_rows, ~dropped], dropped_items
+
+
 def drop_nans(similarity_matrix):
     """Removes NaN values from matrix and returns the matrix.
 
     NOTE: Not using pandas dropna because it would drop the label if any NA values are present.
     Therefore, row that has the most NaNs is found and dropped (gradually removes all NaNs).
+    See prune_nans() if you want to know which items were dropped.
     """
-    while similarity_matrix.isnull().sum().sum() > 0:
-        most_nans = similarity_matrix.isnull().sum().idxmax()
-        similarity_matrix = similarity_matrix.drop(most_nans, axis=0)
-        similarity_matrix = similarity_matrix.drop(most_nans, axis=1)
-
-    return similarity_matrix
+    return prune_nans(similarity_matrix)[0]
 
 
 def replace_nans_with_zero(similarity_matrix):
@@ -17,17 +74,175 @@ def replace_nans_with_zero(similarity_matrix):
     return similarity_matrix.fillna(0)
 
 
-def pearson_similarity(matrix, no_nans=False):
-    """Returns similarity matrix created by applying Pearson on learners' performance data."""
+def to_sparse_correctness_matrix(matrix):
+    """Converts correctness matrix (output of reshape_to_correctness_matrix()) to SparseCorrectnessMatrix."""
+    if isinstance(matrix, SparseCorrectnessMatrix):
+        return matrix
+    values = matrix.values.astype(float)
+    users, questions = np.nonzero(~np.isnan(values))
+    shape = values.shape
+    answered = sparse.csc_matrix((np.ones(len(users)), (users, questions)), shape=shape)
+    correct = sparse.csc_matrix((values[users, questions], (users, questions)), shape=shape)
+    return SparseCorrectnessMatrix(answered, correct, matrix.index, matrix.columns)
+
+
+def pearson_from_moments(n, sum_x, sum_xy, sum_xx, min_periods=1, sum_y=None, sum_yy=None):
+    """Returns Pearson correlation matrix computed from pairwise sufficient statistics.
+
+    All statistics are computed only over the observations where both items have a value,
+    for items a, b: n[a, b] is number of such observations, sum_x[a, b] is sum of values of a,
+    sum_xy[a, b] is sum of products and sum_xx[a, b] is sum of squared values of a.
+    Sums for b (sum_y, sum_yy) are the transposed sums for a by default (square matrix of all pairs).
+    Pairs with less than min_periods observations or zero variance are NaN (same as DataFrame.corr()).
+    """
+    n, sum_x, sum_xy, sum_xx = (np.asarray(statistic, dtype=float) for statistic in (n, sum_x, sum_xy, sum_xx))
+    sum_y = sum_x.T if sum_y is None else np.asarray(sum_y, dtype=float)
+    sum_yy = sum_xx.T if sum_yy is None else np.asarray(sum_yy, dtype=float)
+    variance_x = n * sum_xx - sum_x ** 2
+    variance_y = n * sum_yy - sum_y ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        correlation = (n * sum_xy - sum_x * sum_y) / np.sqrt(variance_x * variance_y)
+    correlation[(n < max(min_periods, 1)) | (variance_x <= 0) | (variance_y <= 0)] = np.nan
+    return np.clip(correlation, -1, 1)
+
+
+def sparse_pearson(answered, correct, min_periods=1):
+    """Returns pairwise-complete Pearson correlation of columns of sparse matrices as a NumPy array.
+
+    Parameters
+    ----------
+    answered : scipy.sparse matrix
+        Binary matrix, 1 where the value is present
+    correct : scipy.sparse matrix
+        Values (zero where the value is not present)
+    min_periods : int
+        Minimum number of observations required per pair of columns to have a valid result
+
+    Returns
+    -------
+    numpy.ndarray
+    """
+    answered = sparse.csc_matrix(answered, dtype=float)
+    correct = sparse.csc_matrix(correct, dtype=float)
+    n = (answered.T @ answered).toarray()
+    sum_x = (correct.T @ answered).toarray()
+    sum_xy = (correct.T @ correct).toarray()
+    sum_xx = (correct.multiply(correct).T @ answered).toarray()
+    return pearson_from_moments(n, sum_x, sum_xy, sum_xx, min_periods)
+
+
+def pearson_similarity(matrix, no_nans=False, min_periods=1):
+    """Returns similarity matrix created by applying Pearson on learners' performance data.
+
+    Correlation is computed from sparse matrices of answered and correct questions,
+    the result is the same as the result of DataFrame.corr() of the correctness matrix.
+
+    Parameters
+    ----------
+    matrix : DataFrame or SparseCorrectnessMatrix
+        Correctness matrix (output of reshape_to_correctness_matrix())
+    no_nans : bool
+        Parameter that specifies, if the similarity matrix can contain NaN values or not
+    min_periods : int
+        Minimum number of users who answered both questions required to have a valid result
+
+    Returns
+    -------
+    DataFrame
+        Similarity matrix
+    """
+    correctness = to_sparse_correctness_matrix(matrix)
+    similarity_matrix = pd.DataFrame(sparse_pearson(correctness.answered, correctness.correct, min_periods),
+                                     index=correctness.questions, columns=correctness.questions)
     if no_nans:
-        return drop_nans(matrix.corr())
+        return drop_nans(similarity_matrix)
     else:
-        return matrix.corr()
+        return similarity_matrix
+
+
+def pearson_similarity_rows(matrix, questions, min_periods=1):
+    """Returns rows of the Pearson similarity matrix only for the specified questions.
 
+    Parameters
+    ----------
+    matrix : DataFrame or SparseCorrectnessMatrix
+        Correctness matrix (output of reshape_to_correctness_matrix())
+    questions : list of int
+        Questions (rows of the result)
+    min_periods : int
+        Minimum number of users who answered both questions required to have a valid result
+
+    Returns
+    -------
+    DataFrame
+        Similarities of the questions (rows) with all questions (columns)
+    """
+    correctness = to_sparse_correctness_matrix(matrix)
+    answered = sparse.csc_matrix(correctness.answered, dtype=float)
+    correct = sparse.csc_matrix(correctness.correct, dtype=float)
+    squared = correct.multiply(correct).tocsc()
+    positions = correctness.questions.get_indexer(questions)
+    if (positions < 0).any():
+        raise ValueError("Some questions are not in the correctness matrix.")
+    rows_answered, rows_correct = answered[:, positions], correct[:, positions]
+    rows = pearson_from_moments((rows_answered.T @ answered).toarray(), (rows_correct.T @ answered).toarray(),
+                                (rows_correct.T @ correct).toarray(), (squared[:, positions].T @ answered).toarray(),
+                                min_periods, sum_y=(rows_answered.T @ correct).toarray(),
+                                sum_yy=(rows_answered.T @ squared).toarray())
+    return pd.DataFrame(rows, index=correctness.questions[positions], columns=correctness.questions)
 
-def doublepearson_similarity(matrix, no_nans=False):
-    """Returns similarity matrix created by applying Pearson twice on learners' performance data."""
+
+def dense_pearson(values, dtype=np.float64):
+    """Returns Pearson correlation of columns of dense matrix as a NumPy array (same as DataFrame.corr()).
+
+    Without NaN values the columns are standardized and the correlation is one matrix product Z.T @ Z.
+    Otherwise pairwise-complete sums are computed by matrix products with the mask of values
+    (see pearson_from_moments()).
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        Matrix with observations in rows
+    dtype : numpy dtype
+        Type of the computation, e.g. np.float32 for faster products with lower precision
+
+    Returns
+    -------
+    numpy.ndarray
+    """
+    values = np.asarray(values, dtype=dtype)
+    missing = np.isnan(values)
+    if not missing.any():
+        centered = values - values.mean(axis=0)
+        norms = np.sqrt((centered ** 2).sum(axis=0))
+        constant = norms == 0
+        norms[constant] = 1
+        standardized = centered / norms
+        correlation = standardized.T @ standardized
+        correlation[constant, :] = np.nan
+        correlation[:, constant] = np.nan
+        if len(values) < 2:
+            correlation[:] = np.nan
+        return np.clip(correlation, -1, 1)
+
+    present = (~missing).astype(dtype)
+    # shifting by the column means doesn't change the correlation, but the sums are more precise
+    with np.errstate(invalid='ignore'):
+        means = np.nan_to_num(np.nansum(values, axis=0) / present.sum(axis=0))
+    centered = np.where(missing, 0, values - means).astype(dtype)
+    return pearson_from_moments(present.T @ present, centered.T @ present, centered.T @ centered,
+                                (centered ** 2).T @ present).astype(dtype)
+
+
+def doublepearson_similarity(matrix, no_nans=False, min_periods=1, dtype=np.float64):
+    """Returns similarity matrix created by applying Pearson twice on learners' performance data.
+
+    The second Pearson is computed by dense_pearson() with the type dtype (e.g. np.float32).
+    """
+    similarity_matrix = pearson_similarity(matrix, no_nans, min_periods)
+    similarity_matrix = pd.DataFrame(dense_pearson(similarity_matrix.values, dtype),
+                                     index=similarity_matrix.index, columns=similarity_matrix.columns)
     if no_nans:
-        return pearson_similarity(pearson_similarity(matrix, True), True)
+        return drop_nans(similarity_matrix)
     else:
-        return pearson_similarity(pearson_similarity(matrix))
+        return similarity_matrix
@@ -6,9 +6,45 @@ def levenshtein_similarity(s1, s2):
     return 1 - (edit_distance(s1, s2) / max(len(s1), len(s2)))
 
 
+def bounded_edit_distance(s1, s2, M):
+    """Computes Edit distance between two words, but only up to the threshold M (returns min(distance, M)).
+
+    Only the diagonal band of width M of the dynamic programming table is filled
+    and the computation stops as soon as the distance reaches M.
+
+    >>> bounded_edit_distance("bylinkář", "bylina", 5)
+    3
+    >>> bounded_edit_distance("křivý", "hřejivý", 2)
+    2
+    """
+    len1, len2 = len(s1), len(s2)
+    if abs(len1 - len2) >= M:
+        return M
+    # values outside of the band are always at least M
+    previous = [min(j, M) for j in range(len2 + 1)]
+    for i in range(1, len1 + 1):
+        current = [M] * (len2 + 1)
+        start, end = max(1, i - M), min(len2, i + M)
+        if start == 1:
+            current[0] = min(i, M)
+        row_minimum = current[start - 1]
+        char = s1[i - 1]
+        for j in range(start, end + 1):
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != s2[j - 1]))
+            if value > M:
+                value = M
+            current[j] = value
+            if value < row_minimum:
+                row_minimum = value
+        if row_minimum >= M:
+            return M
+        previous = current
+    return previous[len2]
+
+
 def levenshtein_similarity_with_threshold(s1, s2, M=5):
     """Computes Levenshtein similarity between two words with a threshold."""
-    return 1 - (min(edit_distance(s1, s2), M) / M)
+    return 1 - (bounded_edit_distance(s1, s2, M) / M)
 
 
 if __name__ == '__main__':
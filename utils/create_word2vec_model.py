@@ -1,7 +1,8 @@
 """
-Usage: python create_word2vec_model.py wiki.cs.text word2vec.model
+Usage: python -m utils.create_word2vec_model utils/wiki.cs.text utils/word2vec.model [utils/word_vectors]
 
 Script for creating/training a word2vec model.
+If the third argument is given, normalized word vectors are also exported (see word_vectors.py).
 """
 
 import logging
@@ -10,6 +11,7 @@ import os
 import sys
 from gensim.models.word2vec import LineSentence
 from gensim.models.word2vec import Word2Vec
+from utils.word_vectors import export_word_vectors
 
 
 if __name__ == '__main__':
@@ -32,3 +34,5 @@ if __name__ == '__main__':
     }
     model = Word2Vec(LineSentence(inp), **params)
     model.save(outp)
+    if len(sys.argv) > 3:
+        export_word_vectors(model, sys.argv[3])
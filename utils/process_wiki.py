@@ -1,39 +1,148 @@
 """
-Usage: python process_wiki.py cswiki-latest-pages-articles.xml.bz2 wiki.cs.text
+Usage: python process_wiki.py cswiki-latest-pages-articles.xml.bz2 wiki.cs.text [--processes N] [--gzip]
 
 Script for converting articles from a Wikipedia dump to a file. A line in that file is a text of an article.
 
+The dump is streamed, pages are parsed and tokenized by a pool of processes (the order of articles is kept)
+and the articles are written in big buffered chunks (optionally as gzip members, so the file stays
+a valid gzip file after each chunk). After each chunk a checkpoint is saved, so an interrupted run
+continues where it stopped, when it's started again with the same arguments.
+
 Download latest CS Wikipedia dump from:
 - https://dumps.wikimedia.org/cswiki/latest/cswiki-latest-pages-articles.xml.bz2
 Adapted from:
 - http://textminingonline.com/training-word2vec-model-on-english-wikipedia-by-gensim
 """
 
+import argparse
+import bz2
+import gzip
+import itertools
+import json
 import logging
+import multiprocessing
 import os.path
 import sys
-from gensim.corpora import WikiCorpus
+import time
+from gensim.corpora.wikicorpus import extract_pages, filter_wiki, tokenize, ARTICLE_MIN_WORDS, IGNORED_NAMESPACES
+
+logger = logging.getLogger(os.path.basename(sys.argv[0]))
+
+
+def process_page(page):
+    """Returns text of the article (tokens separated by spaces) or None for short articles and other namespaces."""
+    title, text, pageid = page
+    if any(title.startswith(ignore + ':') for ignore in IGNORED_NAMESPACES):
+        return None
+    tokens = tokenize(filter_wiki(text), lower=False)
+    if len(tokens) < ARTICLE_MIN_WORDS:
+        return None
+    return " ".join(tokens)
+
+
+def load_checkpoint(checkpoint_path):
+    """Returns number of processed pages, saved articles and bytes of the output file from the checkpoint."""
+    if not os.path.exists(checkpoint_path):
+        return {'pages': 0, 'articles': 0, 'bytes': 0}
+    with open(checkpoint_path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(checkpoint_path, checkpoint):
+    temporary_path = checkpoint_path + '.tmp'
+    with open(temporary_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(temporary_path, checkpoint_path)
+
+
+def write_chunk(out, buffer, compress):
+    """Writes buffered articles, compressed chunk is a separate gzip member."""
+    if not buffer:
+        return
+    chunk = "".join(buffer).encode('utf-8')
+    out.write(gzip.compress(chunk) if compress else chunk)
+    out.flush()
+
+
+def process_wiki(inp, outp, processes=None, compress=False, buffer_size=64 * 1024 * 1024, pages_per_task=50):
+    """Converts Wikipedia dump to a file of articles (one article per line).
+
+    Parameters
+    ----------
+    inp : str
+        Path of the bz2 Wikipedia dump
+    outp : str
+        Path of the output file
+    processes : int
+        Number of processes, all CPUs are used by default.
+    compress : bool
+        True if you want gzip compressed output
+    buffer_size : int
+        Number of characters collected before they are written (and the checkpoint is saved)
+    pages_per_task : int
+        Number of pages sent to a process at once
+
+    Returns
+    -------
+    int
+        Number of saved articles
+    """
+    processes = processes or multiprocessing.cpu_count()
+    checkpoint_path = outp + '.checkpoint'
+    checkpoint = load_checkpoint(checkpoint_path)
+    if checkpoint['pages'] > 0:
+        logger.info("Resuming after %s pages (%s articles)", checkpoint['pages'], checkpoint['articles'])
+
+    with open(inp, 'rb') as raw, open(outp, 'ab') as out, multiprocessing.Pool(processes) as pool:
+        # everything written after the last checkpoint is thrown away
+        out.truncate(checkpoint['bytes'])
+        out.seek(checkpoint['bytes'])
+        pages = extract_pages(bz2.BZ2File(raw), filter_namespaces=('0',))
+        pages = itertools.islice(pages, checkpoint['pages'], None)
+
+        start, start_position = time.time(), raw.tell()
+        buffer, buffered = [], 0
+        articles_at_start = checkpoint['articles']
+        # Pool.imap would read the whole dump in advance, so pages are sent by groups
+        group_size = 10 * processes * pages_per_task
+        while True:
+            group = list(itertools.islice(pages, group_size))
+            if not group:
+                break
+            for text in pool.imap(process_page, group, chunksize=pages_per_task):
+                if text is not None:
+                    buffer.append(text + "\n")
+                    buffered += len(text) + 1
+                    checkpoint['articles'] += 1
+                    if checkpoint['articles'] % 10000 == 0:
+                        elapsed = time.time() - start
+                        logger.info("Saved %s articles (%.0f articles/s, %.2f MB/s of the dump)",
+                                    checkpoint['articles'], (checkpoint['articles'] - articles_at_start) / elapsed,
+                                    (raw.tell() - start_position) / elapsed / 1e6)
+            checkpoint['pages'] += len(group)
+            if buffered >= buffer_size:
+                write_chunk(out, buffer, compress)
+                checkpoint['bytes'] = out.tell()
+                save_checkpoint(checkpoint_path, checkpoint)
+                buffer, buffered = [], 0
+        write_chunk(out, buffer, compress)
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return checkpoint['articles']
 
 
 if __name__ == '__main__':
-    program = os.path.basename(sys.argv[0])
-    logger = logging.getLogger(program)
     logging.basicConfig(format='%(asctime)s: %(levelname)s: %(message)s')
     logging.root.setLevel(level=logging.INFO)
     logger.info("Running %s", ' '.join(sys.argv))
 
-    if len(sys.argv) < 3:
-        print(__doc__)
-        sys.exit(1)
-    inp, outp = sys.argv[1:3]
-
-    i = 0
-    wiki = WikiCorpus(inp, lemmatize=False, dictionary={}, lower=False)
-    with open(outp, 'w') as out:
-        for text in wiki.get_texts():
-            out.write(" ".join(text) + "\n")
-            i += 1
-            if i % 10000 == 0:
-                logger.info("Saved %s articles", i)
+    parser = argparse.ArgumentParser(usage=__doc__)
+    parser.add_argument('inp')
+    parser.add_argument('outp')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--gzip', action='store_true')
+    args = parser.parse_args()
 
+    i = process_wiki(args.inp, args.outp, args.processes, args.gzip)
     logger.info("Finished saving %s articles", i)
@@ -0,0 +1,116 @@
+"""
+Usage: python -m utils.word_vectors utils/word2vec.model utils/word_vectors [--question-bank]
+
+Script for exporting word vectors of a trained word2vec model (see create_word2vec_model.py).
+
+Only L2-normalized float32 vectors (.npy file) and the vocabulary (.vocab file, one word per line) are saved,
+without the rest of the training model. They are loaded with memory mapping, so the loading takes milliseconds
+and the processes that use them share the same pages. With --question-bank only the words that are solutions
+of our questions are exported.
+"""
+
+import logging
+import os
+import sys
+import numpy as np
+
+logger = logging.getLogger(os.path.basename(sys.argv[0]))
+
+
+class WordVectors():
+    """Read-only word vectors, a vector of the word is looked up as in gensim KeyedVectors (word_vectors[word])."""
+
+    def __init__(self, vectors, words):
+        self.vectors = vectors
+        self.words = words
+        self.index = {word: i for i, word in enumerate(words)}
+
+    def __getitem__(self, word):
+        return self.vectors[self.index[word]]
+
+    def __contains__(self, word):
+        return word in self.index
+
+    def __len__(self):
+        return len(self.words)
+
+
+def export_word_vectors(model, path, words=None):
+    """Saves normalized word vectors of the model to path.npy and its vocabulary to path.vocab.
+
+    Parameters
+    ----------
+    model : Word2Vec model or KeyedVectors
+        Trained model
+    path : str
+        Path of the exported vectors without extension
+    words : set of str
+        Words that are exported, all words of the model by default
+    """
+    wv = getattr(model, 'wv', model)
+    vocabulary = list(getattr(wv, 'index_to_key', None) or wv.index2word)
+    vectors = getattr(wv, 'vectors', None)
+    if vectors is None:
+        vectors = wv.syn0
+    if words is not None:
+        rows = [i for i, word in enumerate(vocabulary) if word in words]
+        vocabulary = [vocabulary[i] for i in rows]
+        vectors = vectors[rows]
+
+    vectors = np.array(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    np.save(path + '.npy', vectors / norms)
+    with open(path + '.vocab', 'w', encoding='utf-8') as f:
+        f.writelines(word + "\n" for word in vocabulary)
+    logger.info("Exported %s word vectors to %s", len(vocabulary), path)
+
+
+def load_word_vectors(path, mmap=True):
+    """Returns word vectors exported by export_word_vectors().
+
+    EXAMPLE:
+        word_vectors = load_word_vectors('utils/word_vectors')
+        X, data = get_word2vec_items(word_vectors, data)
+
+    Parameters
+    ----------
+    path : str
+        Path of the exported vectors without extension
+    mmap : bool
+        True if you want to load the vectors with memory mapping (read-only)
+
+    Returns
+    -------
+    WordVectors
+    """
+    vectors = np.load(path + '.npy', mmap_mode='r' if mmap else None)
+    with open(path + '.vocab', encoding='utf-8') as f:
+        words = f.read().splitlines()
+    return WordVectors(vectors, words)
+
+
+def get_question_bank_words(ps_data):
+    """Returns solutions (method 'fillin') of all questions with one underscore in the data."""
+    from data.prepare_data import get_all_solutions
+    questions = ps_data.drop_duplicates('question_id')
+    questions = questions[questions['question'].astype(str).str.count('_') == 1]
+    return set(get_all_solutions(questions)['fillin'])
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s: %(levelname)s: %(message)s')
+    logging.root.setLevel(level=logging.INFO)
+    logger.info("Running %s", ' '.join(sys.argv))
+
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+
+    from gensim.models import Word2Vec
+    inp, outp = sys.argv[1:3]
+    words = None
+    if '--question-bank' in sys.argv[3:]:
+        from data.prepare_data import get_ps_data
+        words = get_question_bank_words(get_ps_data(compact=True))
+    export_word_vectors(Word2Vec.load(inp), outp, words)